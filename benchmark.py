@@ -0,0 +1,470 @@
+# import the necessary packages
+import numpy as np
+import tempfile
+import platform
+import argparse
+import pickle
+import json
+import time
+import os
+import cv2
+
+from model import YOLOv3, MobileNetSSD, ResNet50, GoogleNet
+from dataset import DatabaseOfEncodings, convertPickleToStore
+from gallery import GallerySearch, IVFPQIndex
+from imageLoader import ImageLoader
+from storeVideo import StoreVideo
+from loadVideo import LoadVideo
+from gridView import createGrid
+
+############################   Utils   #########################################################################
+def timeIt(function, repeat: int=20) -> float:
+	""" Return the average time (in milliseconds) of a call of the given function (without parameters). """
+	function()	#warm up (caches, lazy initializations...)
+	start = time.perf_counter()
+	for _ in range(repeat):
+		function()
+	return (time.perf_counter()-start)*1000/repeat
+
+def syntheticYoloOutput(nClasses: int=80, inputSize: int=416, positiveRate: float=0.01, seed: int=0) -> "list of np.ndarray":
+	"""
+		Generate a random output of the 3 yolo layers (strides 32, 16 and 8 with 3 anchors each: ~10k rows at 416x416).
+		Only a fraction (positiveRate) of the rows has a class confidence high enough to pass the usual thresholds.
+	"""
+	rng = np.random.default_rng(seed)
+	output = []
+	for stride in (32, 16, 8):
+		rows = (inputSize//stride)**2 * 3
+		layer = np.zeros((rows, 5+nClasses), dtype=np.float32)
+		layer[:, 0:2] = rng.random((rows, 2))					#center (x, y)
+		layer[:, 2:4] = rng.random((rows, 2)) * 0.3				#width and height
+		layer[:, 5:] = rng.random((rows, nClasses)) * 0.1		#weak class scores
+		positives = rng.random(rows) < positiveRate
+		layer[positives, 5 + rng.integers(0, nClasses, positives.sum())] = rng.uniform(0.5, 1.0, positives.sum())
+		output.append(layer)
+	return output
+
+def syntheticVideo(path: str=None, nFrames: int=200, width: int=1920, height: int=1080, fps: int=30, codec: str="MJPG") -> str:
+	""" Write a video of moving noise and frame numbers (default: a temporary 1080p .avi) and return its path. """
+	if path is None:
+		path = os.path.join(tempfile.gettempdir(), "synthetic_{}x{}_{}.avi".format(width, height, nFrames))
+	if os.path.exists(path):
+		return path
+	rng = np.random.default_rng(0)
+	background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+	writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, (width, height))
+	for i in range(nFrames):
+		frame = np.roll(background, 8*i, axis=1)
+		cv2.putText(frame, str(i), (50, 150), cv2.FONT_HERSHEY_SIMPLEX, 4, (255, 255, 255), 8)
+		writer.write(frame)
+	writer.release()
+	return path
+
+def syntheticEncodings(nLabels: int=518, perLabel: int=10, dim: int=2048, spread: float=0.5, seed: int=0) -> "np.ndarray":
+	""" Generate non-negative encodings clustered by label (like the negativePeople ones: 518 people with 10 images each). """
+	rng = np.random.default_rng(seed)
+	centers = rng.random((nLabels, dim), dtype=np.float32)
+	noise = rng.random((nLabels, perLabel, dim), dtype=np.float32) * spread
+	return (centers[:, None, :] + noise).reshape(-1, dim)
+
+def syntheticSsdOutput(nDetections: int=100, nClasses: int=21, nImages: int=1, seed: int=0) -> "np.ndarray":
+	""" Generate a random (1, 1, nDetections, 7) MobileNetSSD output: [image id, class id, confidence, x1, y1, x2, y2] (relative). """
+	rng = np.random.default_rng(seed)
+	output = np.zeros((1, 1, nDetections, 7), dtype=np.float32)
+	output[0, 0, :, 0] = rng.integers(0, nImages, nDetections)
+	output[0, 0, :, 1] = rng.integers(1, nClasses, nDetections)
+	output[0, 0, :, 2] = rng.random(nDetections)
+	corners = rng.random((nDetections, 2, 2)) * [[0.5], [0.5]]
+	output[0, 0, :, 3:5] = corners[:, 0]
+	output[0, 0, :, 5:7] = corners[:, 0] + 0.1 + corners[:, 1]
+	return output
+
+def syntheticImages(folder: str=None, n: int=100, height: int=128, width: int=64, seed: int=0) -> "list of str":
+	""" Write n random jpg images (by default of the Market-1501 size) and return their paths. """
+	if folder is None:
+		folder = os.path.join(tempfile.gettempdir(), "synthetic_images_{}x{}".format(width, height))
+	os.makedirs(folder, exist_ok=True)
+	rng = np.random.default_rng(seed)
+	paths = []
+	for i in range(n):
+		path = os.path.join(folder, "{:05d}.jpg".format(i))
+		if not os.path.exists(path):
+			cv2.imwrite(path, rng.integers(0, 255, (height, width, 3), dtype=np.uint8))
+		paths.append(path)
+	return paths
+
+def syntheticEncodingStore(storePath: str=None, nLabels: int=518, perLabel: int=10, dim: int=2048, seed: int=0) -> str:
+	""" Write an EncodingStore of synthetic encodings (through a pickle, as convertPickleToStore expects) and return its path. """
+	if storePath is None:
+		storePath = os.path.join(tempfile.gettempdir(), "synthetic_{}x{}_{}.encdb".format(nLabels, perLabel, dim))
+	if not os.path.exists(os.path.join(storePath, "encodings.npy")):
+		encodings = syntheticEncodings(nLabels, perLabel, dim, seed=seed).reshape(nLabels, perLabel, dim)
+		pklPath = storePath + ".pkl"
+		with open(pklPath, "wb") as f:
+			pickle.dump({ label: list(encodings[label]) for label in range(nLabels) }, f)
+		convertPickleToStore(pklPath, storePath)
+		os.remove(pklPath)
+	return storePath
+
+class StandInNet:
+	# A random weights stand-in of a cv2.dnn network, used when the model files under ../models are missing: the output has the
+	# layout of the real network (so the Model code runs unchanged), but the forward pass is only a pooling and a projection.
+	# NB: the forward latency of a stand-in is not the one of the real network, the blob and post processing times are.
+
+	def __init__(self, kind: str, dim: int=None, spatial: bool=False, seed: int=0):
+		""" 
+			kind: "yolo" (3 yolo layers at 416x416), "ssd" (100 detections) or "classifier" (a dim long encoding for each image, 
+			with shape (n, dim) or, if spatial, (n, dim, 1, 1) as a pooling layer).
+		"""
+		self.kind = kind
+		self.dim = dim
+		self.spatial = spatial
+		self.rng = np.random.default_rng(seed)
+		self.weights = None if dim is None else self.rng.standard_normal((3*8*8, dim)).astype(np.float32)
+		self.blob = None
+
+	def setPreferableBackend(self, backend: int) -> None:
+		pass
+
+	def setPreferableTarget(self, target: int) -> None:
+		pass
+
+	def getLayerNames(self) -> list:
+		return [ self.kind ]
+
+	def setInput(self, blob: "np.ndarray") -> None:
+		self.blob = blob
+
+	def forward(self, layer: "str or list"=None) -> "np.ndarray or list":
+		n = len(self.blob)
+		if self.kind=="yolo":
+			outputs = [ syntheticYoloOutput(seed=i) for i in range(n) ]
+			return outputs[0] if n==1 else [ np.stack(layers) for layers in zip(*outputs) ]
+		if self.kind=="ssd":
+			return syntheticSsdOutput(100*n, nImages=n)
+		(h, w) = self.blob.shape[2:]
+		pooled = self.blob[:, :, :h//8*8, :w//8*8].reshape(n, 3, 8, h//8, 8, w//8).mean(axis=(3, 5)).reshape(n, -1)
+		encodings = pooled @ self.weights
+		return encodings.reshape(n, self.dim, 1, 1) if self.spatial else encodings
+
+def loadModel(modelClass: type, standIn: bool=None) -> ("Model", bool):
+	"""
+		Return the model (with the default files under ../models) and True, or, if the files are missing (or standIn is True), 
+		the model with a StandInNet and False.
+	"""
+	if not standIn:
+		try:
+			return (modelClass(), True)
+		except (cv2.error, OSError, AttributeError):	#missing files (or a reader missing in this opencv build)
+			if standIn is False:
+				raise
+	model = modelClass.__new__(modelClass)
+	if modelClass is YOLOv3:
+		(model.names, model.layer, net) = ([ str(i) for i in range(80) ], None, StandInNet("yolo"))
+	elif modelClass is MobileNetSSD:
+		(model.names, model.layer, model.asArray, net) = ([ str(i) for i in range(21) ], None, False, StandInNet("ssd"))
+	else:
+		(model.layer, net) = (None, StandInNet("classifier", 2048, False) if modelClass is ResNet50 else StandInNet("classifier", 1024, True))
+	model.setNetwork(net)
+	return (model, False)
+
+def yoloProcessDnnOutputLoop(names: list, output, h: int, w: int, confThresh: float=0.5, nmsThresh: float=0.3) -> "list of list":
+	""" The original (one python iteration for each detection) implementation of YOLOv3.processDnnOutput, used as reference. """
+	classes = []
+	confidences = []
+	boxes = []
+	for oneLayerOutput in output:
+		for detection in oneLayerOutput:
+			scores = detection[5:]
+			classID = np.argmax(scores)
+			confidence = scores[classID]
+			if confidence > confThresh:
+				box = detection[0:4] * np.array([w, h, w, h])
+				(centerX, centerY, width, height) = box.astype("int")
+				x = int(centerX - (width / 2))
+				y = int(centerY - (height / 2))
+				classes.append(names[classID])
+				confidences.append(float(confidence))
+				boxes.append([x, y, int(width), int(height)])
+
+	idxs = cv2.dnn.NMSBoxes(boxes, confidences, confThresh, nmsThresh)
+	idxs = np.array(idxs).flatten()
+	return [ [classes[i], confidences[i], boxes[i]] for i in idxs ]
+
+############################   Benchmarks   ####################################################################
+def benchmarkYoloProcessDnnOutput(repeat: int=20, h: int=720, w: int=1280) -> dict:
+	""" Compare the vectorized YOLOv3.processDnnOutput with the original python loop (and check that the results are the same). """
+	yolo = YOLOv3.__new__(YOLOv3)	#the post processing do not need the network (so the model files are not required)
+	yolo.names = [ str(i) for i in range(80) ]
+	output = syntheticYoloOutput(len(yolo.names))
+
+	expected = yoloProcessDnnOutputLoop(yolo.names, output, h, w)
+	obtained = yolo.processDnnOutput(output, h, w)
+	if expected != obtained:
+		print("Warning: the vectorized and the loop implementations return different detections.")
+
+	results = {
+		"rows":		   sum(len(layer) for layer in output),
+		"detections":  len(obtained),
+		"loopMs":	   timeIt(lambda: yoloProcessDnnOutputLoop(yolo.names, output, h, w), repeat),
+		"vectorizedMs": timeIt(lambda: yolo.processDnnOutput(output, h, w), repeat)
+	}
+	results["speedup"] = results["loopMs"] / results["vectorizedMs"]
+	return results
+
+def benchmarkIVFPQ(encodings: "np.ndarray"=None, nQueries: int=200, k: int=10, nProbes: tuple=(1, 2, 4, 8, 16, 32), 
+				   nList: int=64, m: int=16, seed: int=0) -> "list of dict":
+	"""
+		Recall@k and latency of the IVFPQIndex (one measure for each nProbe) against the exact GallerySearch.
+		The encodings default to the ones of the negativePeople dataset (resNet50), or to synthetic ones if the dataset is missing.
+		The queries are held out: nQueries random encodings are removed from the gallery and searched in it (their neighbours are
+		the other encodings of the same label, not a near copy of themselves, so the recall depends on nProbe).
+	"""
+	if encodings is None:
+		database = DatabaseOfEncodings("resNet50")
+		if database.store.exists() or os.path.exists(database.encodingsPath):
+			encodings = GallerySearch.fromDatabase(database).matrix
+		else:
+			print("[INFO] negativePeople encodings not found: using synthetic encodings")
+			#overlapping labels: the neighbours of a query spread over more lists (with the default spread each label is isolated)
+			encodings = syntheticEncodings(nLabels=2000, dim=512, spread=0.8, seed=seed)
+
+	rng = np.random.default_rng(seed)
+	heldOut = np.zeros(len(encodings), dtype=bool)
+	heldOut[rng.choice(len(encodings), nQueries, replace=False)] = True
+	(queries, encodings) = (np.asarray(encodings[heldOut]), np.asarray(encodings[~heldOut]))
+
+	exact = GallerySearch(encodings, [ (i, None) for i in range(len(encodings)) ], metric="cosine")
+	(truth, _) = exact.search(queries, k)
+	results = [ {"method": "exact", "nProbe": None, "recall": 1.0, "msPerQuery": timeIt(lambda: exact.search(queries, k), 3)/nQueries} ]
+
+	index = IVFPQIndex(nList=nList, m=m, metric="cosine", seed=seed)
+	index.train(encodings)
+	index.add(encodings)
+	for nProbe in nProbes:
+		(ids, _) = index.search(queries, k, nProbe)
+		recall = np.mean([ len(np.intersect1d(a, b))/k for (a, b) in zip(ids, truth) ])
+		results.append({"method": "ivfpq", "nProbe": nProbe, "recall": float(recall), "msPerQuery": timeIt(lambda: index.search(queries, k, nProbe), 3)/nQueries})
+	return results
+
+def benchmarkBlob(repeat: int=50, width: int=1280, height: int=720) -> dict:
+	"""
+		Time (ms) to create the blob of a frame for each model: cv2.dnn.blobFromImage (the blob allocated by opencv), Model.blob
+		(blobFromImagesWithParams writing in a blob allocated by numpy) and Model.blobInto with a reused blob (no allocation).
+	"""
+	frame = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+	results = {}
+	for modelClass in (YOLOv3, MobileNetSSD, ResNet50, GoogleNet):
+		model = modelClass.__new__(modelClass)	#only the blob parameters are needed: no network is loaded
+		mean = model.blobMean if isinstance(model.blobMean, (tuple, list)) else (model.blobMean, 0, 0)
+		blob = model.newBlob(1)
+		reference = timeIt(lambda: cv2.dnn.blobFromImage(frame, model.blobScale, model.blobSize, mean, model.blobSwapRB, crop=False), repeat)
+		modelBlob = timeIt(lambda: model.blob(frame), repeat)
+		results[modelClass.__name__] = { "blobFromImageMs": reference, "blobMs": modelBlob, "blobIntoMs": timeIt(lambda: model.blobInto([frame], blob), repeat),
+										 "speedup": reference/modelBlob }
+	return results
+
+def benchmarkLoadVideo(videoPath: str=None, nFrames: int=200, width: int=1280, height: int=720) -> dict:
+	""" Throughput (fps) of LoadVideo.read until the end of the video (with and without a preallocated out), and of a bare cv2.VideoCapture. """
+	videoPath = syntheticVideo(nFrames=nFrames, width=width, height=height) if videoPath is None else videoPath
+
+	def capture() -> int:
+		(capture, n) = (cv2.VideoCapture(videoPath), 0)
+		while capture.read()[0]:
+			n += 1
+		capture.release()
+		return n
+
+	def loadVideo(out: bool=False, realtimeMode: str=None) -> int:
+		loader = LoadVideo(videoPath, warmUp=0, realtimeMode=realtimeMode)
+		buffer = np.empty((height, width, 3), dtype=np.uint8) if out else None
+		n = 0
+		while loader.read(buffer) is not None:
+			n += 1
+		loader.release()
+		return n
+
+	results = {}
+	for (name, function) in (("cv2.VideoCapture", capture), ("LoadVideo", loadVideo), ("LoadVideo(out)", lambda: loadVideo(True)),
+							 ("LoadVideo(adaptive)", lambda: loadVideo(realtimeMode="adaptive"))):
+		start = time.perf_counter()
+		n = function()
+		elapsed = time.perf_counter()-start
+		results[name] = { "frames": n, "fps": n/elapsed }
+	return results
+
+def benchmarkModelFeed(repeat: int=20, batchSize: int=8, height: int=720, width: int=1280, standIn: bool=None) -> dict:
+	""" Latency (ms) of Model.feed and per image of Model.feedBatch, for each Model subclass (with the real or the stand-in network). """
+	rng = np.random.default_rng(0)
+	images = [ rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(batchSize) ]
+	results = {}
+	for modelClass in (YOLOv3, MobileNetSSD, ResNet50, GoogleNet):
+		(model, real) = loadModel(modelClass, standIn)
+		results[modelClass.__name__] = {
+			"net":				 "real" if real else "standIn",
+			"feedMs":			 timeIt(lambda: model.feed(images[0]), repeat),
+			"feedBatchMsPerImage": timeIt(lambda: model.feedBatch(images), max(1, repeat//batchSize)) / batchSize
+		}
+	return results
+
+def benchmarkProcessDnnOutput(repeat: int=20, h: int=720, w: int=1280, positiveRates: tuple=(0.001, 0.01, 0.05, 0.2),
+							  ssdDetections: tuple=(100, 1000, 10000)) -> dict:
+	""" Cost (ms) of processDnnOutput against the number of candidates: YOLOv3 rows above the threshold, MobileNetSSD detections. """
+	(yolo, _) = loadModel(YOLOv3, standIn=True)
+	(ssd, _) = loadModel(MobileNetSSD, standIn=True)
+	results = { "YOLOv3": [], "MobileNetSSD": [] }
+	for rate in positiveRates:
+		output = syntheticYoloOutput(positiveRate=rate)
+		candidates = int(sum( (layer[:, 5:].max(axis=1) > 0.5).sum() for layer in output ))
+		results["YOLOv3"].append({ "candidates": candidates, "detections": len(yolo.processDnnOutput(output, h, w)),
+								   "ms": timeIt(lambda: yolo.processDnnOutput(output, h, w), repeat) })
+	for n in ssdDetections:
+		output = syntheticSsdOutput(n)
+		results["MobileNetSSD"].append({ "candidates": int((output[0, 0, :, 2] > 0.5).sum()), "rows": n,
+										 "ms": timeIt(lambda: ssd.processDnnOutput(output, h, w), repeat),
+										 "asArrayMs": timeIt(lambda: ssd.processDnnOutput(output, h, w, asArray=True), repeat) })
+	return results
+
+def benchmarkGetNEncodings(ns: tuple=(1, 10, 100, 1000, 5000), repeat: int=20, storePath: str=None) -> list:
+	""" Latency (ms) of DatabaseOfEncodings.getNEncodings against n, on the resNet50 store (a synthetic one if it is missing). """
+	database = DatabaseOfEncodings("resNet50", seed=0)
+	if storePath is None and not database.store.exists() and not os.path.exists(database.encodingsPath):
+		storePath = syntheticEncodingStore()
+	if storePath is not None:
+		database = DatabaseOfEncodings("resNet50", storePath=storePath, seed=0)
+
+	results = []
+	for n in ns:
+		n = min(n, database.remaining() + database.nextPos)
+		elapsed = 0.0
+		for _ in range(repeat):
+			database.reset()
+			start = time.perf_counter()
+			database.getNEncodings(n)
+			elapsed += time.perf_counter()-start
+		results.append({ "n": n, "ms": elapsed*1000/repeat, "usPerEncoding": elapsed*1e6/repeat/n })
+	return results
+
+def benchmarkCreateGrid(sizes: tuple=((2, 5), (4, 5), (8, 8), (10, 10)), repeat: int=10) -> list:
+	""" Time (ms) of createGrid against the grid size, with the images in the cache of the loader (default and singleBuffer modes). """
+	paths = syntheticImages(n=max(x*y for (x, y) in sizes))
+	loader = ImageLoader()
+	results = []
+	for (x, y) in sizes:
+		topK = [ (i%3, path) for (i, path) in enumerate(paths[:x*y]) ]
+		canvas = createGrid(topK, x, y, loader=loader, singleBuffer=True)
+		results.append({ "x": x, "y": y, "images": x*y,
+						 "ms": timeIt(lambda: createGrid(topK, x, y, loader=loader), repeat),
+						 "singleBufferMs": timeIt(lambda: createGrid(topK, x, y, loader=loader, singleBuffer=True, canvas=canvas), repeat) })
+	loader.release()
+	return results
+
+def benchmarkStoreVideo(nFrames: int=200, height: int=720, width: int=1280, codecs: tuple=("MJPG", "MPEG")) -> list:
+	""" Throughput (fps) of StoreVideo.addFrame (up to the release of the file), for each codec, writing on the caller thread or in background. """
+	rng = np.random.default_rng(0)
+	frames = [ rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(8) ]
+	folder = tempfile.mkdtemp()
+	results = []
+	for codec in codecs:
+		for background in (False, True):
+			writer = StoreVideo(os.path.join(folder, "{}_{}".format(codec, background)), fps=30, codec=codec, background=background)
+			start = time.perf_counter()
+			for i in range(nFrames):
+				writer.addFrame(frames[i % len(frames)])
+			writer.release()
+			elapsed = time.perf_counter()-start
+			results.append({ "codec": codec, "background": background, "frames": writer.frames, "fps": nFrames/elapsed,
+							 "MB": os.path.getsize(writer.output)/2**20 })
+			os.remove(writer.output)
+	os.rmdir(folder)
+	return results
+
+############################   Suite   #########################################################################
+def environment() -> dict:
+	""" The description of the host and of the libraries, saved with the results (runs are comparable only on the same host). """
+	return { "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "host": platform.node(), "machine": platform.machine(),
+			 "processor": platform.processor(), "cpus": os.cpu_count(), "python": platform.python_version(),
+			 "numpy": np.__version__, "opencv": cv2.__version__, "cv2Threads": cv2.getNumThreads() }
+
+def runAll(output: str=None, quick: bool=False) -> dict:
+	""" 
+		Run all the benchmarks (quick: less frames and repetitions) and return their results, with the environment.
+		If output is given the results are also saved there as JSON (see compareResults).
+	"""
+	(repeat, nFrames) = (5, 60) if quick else (20, 200)
+	benchmarks = {
+		"loadVideo":			lambda: benchmarkLoadVideo(nFrames=nFrames),
+		"modelFeed":			lambda: benchmarkModelFeed(repeat=repeat),
+		"processDnnOutput":		lambda: benchmarkProcessDnnOutput(repeat=repeat),
+		"yoloVectorized":		lambda: benchmarkYoloProcessDnnOutput(repeat=repeat),
+		"getNEncodings":		lambda: benchmarkGetNEncodings(repeat=repeat),
+		"createGrid":			lambda: benchmarkCreateGrid(repeat=max(1, repeat//2)),
+		"storeVideo":			lambda: benchmarkStoreVideo(nFrames=nFrames),
+		"blob":				lambda: benchmarkBlob(repeat=repeat),
+		"ivfpq":				lambda: benchmarkIVFPQ(nQueries=50 if quick else 200),
+	}
+	results = { "environment": environment(), "quick": quick, "results": {} }
+	for (name, benchmark) in benchmarks.items():
+		start = time.perf_counter()
+		results["results"][name] = benchmark()
+		print("[INFO] {} done in {:.1f}s".format(name, time.perf_counter()-start))
+
+	if output is not None:
+		if os.path.dirname(output):
+			os.makedirs(os.path.dirname(output), exist_ok=True)
+		with open(output, "w") as f:
+			json.dump(results, f, indent=1)
+		print("[INFO] results saved in:", output)
+	return results
+
+def _flatten(value, prefix: str="") -> dict:
+	""" Return the numeric leaves of the results as { "path/of/the/value": number } (list items are named by index and first key). """
+	if isinstance(value, dict):
+		items = value.items()
+	elif isinstance(value, list):
+		items = [ ("{}:{}={}".format(i, *next(iter(v.items()))) if isinstance(v, dict) and v else str(i), v) for (i, v) in enumerate(value) ]
+	else:
+		return { prefix: value } if isinstance(value, (int, float)) and not isinstance(value, bool) else {}
+	flat = {}
+	for (key, v) in items:
+		flat.update(_flatten(v, "{}/{}".format(prefix, key) if prefix else str(key)))
+	return flat
+
+def compareResults(oldPath: str, newPath: str, tolerance: float=0.1, show: bool=True) -> list:
+	""" 
+		Compare two results files of runAll: return (and show) the times (ms), throughputs (fps, speedup) and recalls that are worse 
+		than the old ones by more than tolerance (relative), as (name, old, new) tuples.
+	"""
+	old = _flatten(json.load(open(oldPath))["results"])
+	new = _flatten(json.load(open(newPath))["results"])
+	regressions = []
+	for (name, value) in new.items():
+		if name not in old or old[name]==0:
+			continue
+		metric = name.split("/")[-1]
+		change = (value - old[name]) / old[name]
+		if metric.endswith("Ms") or metric=="ms" or metric.startswith("ms") or metric.endswith("PerEncoding"):
+			worse = change > tolerance		#lower is better
+		elif metric in ("fps", "speedup", "recall"):
+			worse = change < -tolerance		#higher is better
+		else:
+			continue
+		if worse:
+			regressions.append((name, old[name], value))
+			if show:
+				print("Regression {}: {:.4g} -> {:.4g} ({:+.0%})".format(name, old[name], value, change))
+	return regressions
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Offline benchmarks of the opencvPyUtils hot paths (synthetic data and stand-in networks).")
+	parser.add_argument("--output", default=os.path.join("benchmarkResults", time.strftime("benchmark_%Y%m%d_%H%M%S.json")),
+						help="the JSON file of the results (default: a new file in the ignored benchmarkResults folder)")
+	parser.add_argument("--quick", action="store_true", help="less frames and repetitions")
+	parser.add_argument("--compare", default=None, help="a previous results file: show the regressions of this run")
+	args = parser.parse_args()
+
+	results = runAll(args.output, args.quick)
+	print(json.dumps(results["results"], indent=1))
+	if args.compare is not None:
+		compareResults(args.compare, args.output)
@@ -0,0 +1,142 @@
+# import the necessary packages
+import numpy as np
+import time
+
+from embeddingCache import perceptualHash
+from tracker import toBoxes
+
+class CropEncoder:
+	# The class link a detector to an image classification Model (e.g. ResNet50, GoogleNet) used as encoder: the boxes of a frame
+	# are clipped to the image, cropped (as views, without copies) and encoded with a single batched forward pass.
+	# The result is the (n, d) matrix of the encodings, one row for each kept detection.
+	# With an EmbeddingCache only the crops that are not cached (by track id or perceptual hash) are encoded.
+
+	def __init__(self, model: "Model", labels: "list"=("person",), minSize: tuple=(0, 0), normalize: bool=False, maxBatchSize: int=None,
+			  cache: "EmbeddingCache"=None):
+		"""
+		Initialization function of the CropEncoder class.
+
+		Parameters:
+		model (Model):			The encoder (its blobBatch and forward are used, the output of its layer is flattened).
+		labels (list):			The labels of the detections to encode (None means all the detections).
+		minSize (tuple):		The minimum (width, height) of a box (after the clip) to be encoded.
+		normalize (bool):		If to scale each encoding to unit L2 norm (as needed by the cosine metric of GallerySearch).
+		maxBatchSize (int):		The maximum number of crops of a single forward pass (None means the value of the model).
+		cache (EmbeddingCache):	The optional cache of the encodings (the track id is the 4th element of a detection of a Tracker).
+		"""
+		self.model = model
+		self.labels = None if labels is None else set(labels)
+		self.minSize = minSize
+		self.normalize = normalize
+		self.maxBatchSize = model.maxBatchSize if maxBatchSize is None else max(1, int(maxBatchSize))
+		self.cache = cache
+		self.dim = None					#the length of an encoding (known after the first forward pass)
+
+		self.stageNames = ["clip", "cache", "blob", "forward"]
+		self._time = { name: 0.0 for name in self.stageNames }	#seconds spent in each stage
+		self.frames = 0
+		self.crops = 0
+
+	### Public functions
+	def clip(self, detections: "list or np.ndarray", h: int, w: int) -> tuple:
+		"""
+			Clip the boxes of the detections to an image of size (h, w) and filter them by label and minSize.
+			Return the indexes of the kept detections (n,) and their clipped boxes (n, 4) as x1, y1, x2, y2 integers.
+		"""
+		(labels, _, boxes) = toBoxes(detections)
+		corners = np.rint(np.concatenate([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]], axis=1)).astype(np.int64)
+		np.clip(corners[:, 0::2], 0, w, out=corners[:, 0::2])
+		np.clip(corners[:, 1::2], 0, h, out=corners[:, 1::2])
+
+		keep = ((corners[:, 2]-corners[:, 0]) >= max(1, self.minSize[0])) & ((corners[:, 3]-corners[:, 1]) >= max(1, self.minSize[1]))
+		if self.labels is not None:
+			keep &= np.array([ label in self.labels for label in labels ], dtype=bool)
+		indexes = np.flatnonzero(keep)
+		return (indexes, corners[indexes])
+
+	def encode(self, frame: "image", detections: "list or np.ndarray") -> tuple:
+		"""
+			Encode the detections of the frame (the output of processDnnOutput, or the tracks of a Tracker).
+			Return (encodings, indexes): encodings[i] is the encoding of detections[indexes[i]] (an (n, d) float32 matrix, also
+			without detections: (0, d)).
+		"""
+		start = time.perf_counter()
+		(h, w) = frame.shape[:2]
+		(indexes, corners) = self.clip(detections, h, w)
+		crops = [ frame[y1:y2, x1:x2] for (x1, y1, x2, y2) in corners.tolist() ]	#views of the frame
+		self._account("clip", start)
+
+		if self.cache is None:
+			encodings = self._encodeCrops(crops)
+		else:
+			encodings = self._encodeCached(crops, self._trackIds(detections, indexes))
+		self.frames += 1
+		self.crops += len(crops)
+		return (encodings, indexes)
+
+	def stats(self) -> dict:
+		""" Return the processed frames and crops and, for each stage, the total seconds and the mean milliseconds per frame. """
+		stats = { "frames": self.frames, "crops": self.crops }
+		for name in self.stageNames:
+			stats[name] = { "seconds": self._time[name], "msPerFrame": 1000*self._time[name]/self.frames if self.frames>0 else 0.0 }
+		if self.cache is not None:
+			stats["cacheStats"] = self.cache.stats()
+		return stats
+
+	### Private functions
+	def _trackIds(self, detections: "list or np.ndarray", indexes: "np.ndarray") -> list:
+		""" Return the track id of each kept detection (None for the detections without one). """
+		if isinstance(detections, np.ndarray):
+			return [ None ] * len(indexes)
+		return [ detections[i][3] if len(detections[i])>3 else None for i in indexes.tolist() ]
+
+	def _encodeCached(self, crops: "list of images", trackIds: list) -> "np.ndarray":
+		""" Take the cached encodings of the crops, encode only the missing ones (and cache them). """
+		start = time.perf_counter()
+		self.cache.nextFrame()
+		hashes = [ perceptualHash(crop) for crop in crops ]
+		cached = [ self.cache.lookup(h, trackId) for (h, trackId) in zip(hashes, trackIds) ]
+		missing = [ i for (i, encoding) in enumerate(cached) if encoding is None ]
+		self._account("cache", start)
+
+		computed = self._encodeCrops([ crops[i] for i in missing ])
+		for (i, encoding) in zip(missing, computed):
+			cached[i] = encoding.copy()		#a copy, not to keep alive the whole matrix
+			self.cache.store(hashes[i], cached[i], trackIds[i])
+		if len(cached)==0:
+			return self._empty()
+		return np.stack(cached)
+
+	def _encodeCrops(self, crops: "list of images") -> "np.ndarray":
+		""" Encode the crops in chunks of maxBatchSize, each one with a single forward pass. """
+		encodings = None
+		for first in range(0, len(crops), self.maxBatchSize):
+			chunk = crops[first : first+self.maxBatchSize]
+			start = time.perf_counter()
+			blob = self.model.blobBatch(chunk)
+			self._account("blob", start)
+
+			start = time.perf_counter()
+			self.model.setInput(blob)
+			output = np.asarray(self.model.forward()).reshape(len(chunk), -1)
+			if encodings is None:
+				self.dim = output.shape[1]
+				encodings = np.empty((len(crops), self.dim), dtype=np.float32)
+			encodings[first : first+len(chunk)] = output
+			self._account("forward", start)
+
+		if encodings is None:
+			encodings = self._empty()
+		elif self.normalize:
+			encodings /= np.maximum(np.linalg.norm(encodings, axis=1, keepdims=True), 1e-12)
+		return encodings
+
+	def _empty(self) -> "np.ndarray":
+		""" Return the (0, d) encodings of a frame without crops (the first time d is found with a forward pass of a black image). """
+		if self.dim is None:
+			self.model.setInput(np.zeros_like(self.model.newBlob(1)))
+			self.dim = np.asarray(self.model.forward()).reshape(1, -1).shape[1]
+		return np.empty((0, self.dim), dtype=np.float32)
+
+	def _account(self, name: str, start: float) -> None:
+		self._time[name] += time.perf_counter() - start
@@ -1,15 +1,114 @@
 # import the necessary packages
 from abc import ABC # ABC = Abstract Method Class
 from imutils import paths
+import hashlib
 import random
+import json
 import os
 
+from imageLoader import sharedLoader
+
 ################################################################################################################
 ############################     Dataset Abstract Class     ####################################################
 ################################################################################################################
 #For abstract class look at: https://www.geeksforgeeks.org/abstract-classes-in-python/
 class Dataset(ABC):
-
+	### Manifest (index of the images of a folder)
+	# Each folder is scanned once: the list of its images (in the same order of paths.list_images) and their labels are kept 
+	# in memory and persisted in a json manifest inside manifestDir. A manifest is valid until the modification time of one 
+	# of the scanned directories changes, so the following queries are answered by index lookup instead of a directory walk.
+	# The labels come from labelFromPath, so a manifest belongs to a (dataset class, folder) couple.
+	manifestDir: str = os.path.join(os.path.expanduser("~"), ".cache", "opencvPyUtils", "manifests")
+	_manifests: dict = {}	#(dataset class name, folder) -> manifest, shared by all the datasets of the process
+
+	def labelFromPath(self, pth: str) -> "int or None":
+		""" Return the label of the image at the given path (None if the dataset cannot get it from the path). """
+		return None
+
+	def listImages(self, folder: str) -> "list of str":
+		""" Return the paths of the images inside the folder (the same of list(paths.list_images(folder))). """
+		return self.__manifest(folder)["paths"]
+
+	def imagePath(self, folder: str, i: int) -> str:
+		""" Return the path of the i-th image of the folder. """
+		return self.__manifest(folder)["paths"][i]
+
+	def pathsOfLabel(self, folder: str, label: int) -> "list of str":
+		""" Return the paths of the images of the folder with the given label (see labelFromPath). """
+		manifest = self.__manifest(folder)
+		if "byLabel" not in manifest:
+			byLabel = {}
+			for (pth, lbl) in zip(manifest["paths"], manifest["labels"]):
+				byLabel.setdefault(lbl, []).append(pth)
+			manifest["byLabel"] = byLabel
+		return manifest["byLabel"].get(label, [])
+
+	def __manifest(self, folder: str) -> dict:
+		""" Return the (valid) manifest of the folder: from memory, from disk or with a new scan. """
+		key = (type(self).__name__, folder)
+		manifest = Dataset._manifests.get(key)
+		if manifest is None or not self.__isValid(manifest):
+			name = type(self).__name__ + "_" + hashlib.md5(os.path.abspath(folder).encode()).hexdigest()
+			manifestPath = os.path.join(self.manifestDir, name + ".json")
+			manifest = None
+			if os.path.exists(manifestPath):
+				try:
+					with open(manifestPath) as f:
+						manifest = json.load(f)
+				except (ValueError, OSError):
+					manifest = None		#corrupted (or unreadable) manifest: scan again
+			if manifest is None or not self.__isValid(manifest):
+				manifest = self.__scan(folder)
+				self.__save(manifest, manifestPath)
+			Dataset._manifests[key] = manifest
+		return manifest
+
+	def __save(self, manifest: dict, manifestPath: str) -> None:
+		""" Write the manifest atomically (a crash never leaves a truncated file), only in memory if manifestDir is not writable. """
+		tmpPath = "{}.tmp{}".format(manifestPath, os.getpid())
+		try:
+			os.makedirs(self.manifestDir, exist_ok=True)
+			with open(tmpPath, "w") as f:
+				json.dump(manifest, f)
+			os.replace(tmpPath, manifestPath)
+		except OSError as e:
+			print("[INFO] Warning: cannot write the manifest {} ({}), it is kept only in memory".format(manifestPath, e))
+			if os.path.exists(tmpPath):
+				os.remove(tmpPath)
+
+	def __isValid(self, manifest: dict) -> bool:
+		""" A manifest is valid if no scanned directory has been modified (or removed). """
+		try:
+			return all( os.stat(d).st_mtime==mtime for (d, mtime) in manifest["dirs"].items() )
+		except OSError:
+			return False
+
+	def __scan(self, folder: str) -> dict:
+		""" Walk the folder (like paths.list_images) to list its images, recording the modification time of each directory. """
+		dirs = {}
+		imagesPaths = []
+		for (rootDir, _, filenames) in os.walk(folder):
+			dirs[rootDir] = os.stat(rootDir).st_mtime
+			for filename in filenames:
+				if filename[filename.rfind("."):].lower().endswith(paths.image_types):
+					imagesPaths.append(os.path.join(rootDir, filename))
+		return { "folder": folder, "dirs": dirs, "paths": imagesPaths, "labels": [ self.__safeLabel(pth) for pth in imagesPaths ] }
+
+	def __safeLabel(self, pth: str) -> "int or None":
+		""" The label of the image, or None for the images whose path does not follow the naming of the dataset. """
+		try:
+			return self.labelFromPath(pth)
+		except ValueError:
+			return None
+
+	### Images
+	def loadImages(self, labelsAndPaths: "list of couple", loader: "ImageLoader"=None) -> "list of images":
+		""" Load the images of the given (label, path) couples (in parallel and with cache), with the given ImageLoader or the shared one. """
+		if loader is None:
+			loader = sharedLoader
+		return loader.readMany([ pth for (_, pth) in labelsAndPaths ])
+
+	### Main Functions
 	def getLabelsAndPaths(self) -> "list of couple":
 		""" Create a "list of couple" of lenght (nImgs) with key (1) the label of the person and value (2) the paths of its images. """
 		pass
@@ -34,16 +133,16 @@ class NegativePeopleDataset(Dataset):
 			self.nImgs = self.N_IMAGES*nTestDir
 			print("Warning: not enoght images in the dataset (set to", self.nImgs, ")")
 
-	### Private functions
-	def __labelFromPath(self, pth):
-		return( int(pth.split("/")[-1].split(".")[0]) )
+	def labelFromPath(self, pth: str) -> int:
+		return( int(pth.replace("\\", "/").split("/")[-1].split(".")[0]) )
 
+	### Private functions
 	def __getLabelsAndPaths_fromFolder(self, folderPath, nImgs) -> "list of couple":
 		labelsAndPaths = []
-		imagesPaths = list(paths.list_images(folderPath))[:nImgs]
+		imagesPaths = self.listImages(folderPath)[:nImgs]
 		for pth in imagesPaths:
 			pth = pth.replace("\\", "/")
-			label = self.__labelFromPath(pth)
+			label = self.labelFromPath(pth)
 			labelsAndPaths.append((label, pth))
 		
 		return(labelsAndPaths)
@@ -68,8 +167,8 @@ class NegativePeopleDataset(Dataset):
 		if queryNum is None:
 			#get a random image
 			num = random.randint(0, self.nImgs//self.nTestDir)
-			queryPath = list(paths.list_images(setImgs))[num]
-			queryNum = self.__labelFromPath(queryPath)
+			queryPath = self.imagePath(setImgs, num)
+			queryNum = self.labelFromPath(queryPath)
 		else:
 			#get the image chosen from the user
 			queryPath = "".join([setImgs, f'{queryNum:04}', ".jpg"])
@@ -94,7 +193,7 @@ class StreetPeopleDataset(Dataset):
 		camera = '/'.join([self.datasetPath, "cam_a"])
 
 		# select some images
-		imagesPaths = list(paths.list_images(camera))[:self.nImgs]
+		imagesPaths = self.listImages(camera)[:self.nImgs]
 		labelsAndPaths = list(enumerate(imagesPaths))
 		return(labelsAndPaths)
 
@@ -102,7 +201,7 @@ class StreetPeopleDataset(Dataset):
 		camera = '/'.join([self.datasetPath, "cam_b"])
 		if queryNum is None:
 			queryNum = random.randint(0, self.nImgs)
-		queryPath = list(paths.list_images(camera))[queryNum]
+		queryPath = self.imagePath(camera, queryNum)
 		return((queryNum, queryPath))
 
 ############################     M100 dataset functions                #########################################
@@ -120,7 +219,7 @@ class M100Dataset(Dataset):
 		samples = random.sample(range(self.N_IMAGES), self.nImgs+1)
 		self.myQueryNum = samples[0]
 
-		imagesPaths = list(paths.list_images(self.datasetPath))
+		imagesPaths = self.listImages(self.datasetPath)
 		labelsAndPaths = []
 		for s in samples[1:]:
 			#todo: check correctness with 19, 29, 39 and so on...
@@ -133,7 +232,7 @@ class M100Dataset(Dataset):
 	def queryImgPath(self, queryNum: int=None) -> (int, str):
 		if queryNum is None:
 			queryNum = self.myQueryNum
-		queryPath = list(paths.list_images(self.datasetPath))[queryNum]
+		queryPath = self.imagePath(self.datasetPath, queryNum)
 		print("\nQUERY name:{}, id:{}, path:{}".format(queryNum, queryNum//10, queryPath))
 		return((queryNum//10, queryPath))
 
@@ -141,8 +240,91 @@ class M100Dataset(Dataset):
 ################################################################################################################
 ############################     Encoding Class             ####################################################
 ################################################################################################################
+import numpy as np
+import shutil
 import pickle
 import pprint
+
+def convertPickleToStore(pklPath: str, storePath: str) -> "EncodingStore":
+	""" 
+		Convert a pickle of encodings (a dict: label -> list of feature vectors) into the binary format of EncodingStore.
+		The encodings of the same label are stored in consecutive rows of a float32 matrix.
+		The files are written in a temporary folder renamed to storePath at the end: an interrupted conversion never looks complete.
+	"""
+	encodings = pickle.loads(open(pklPath, "rb").read())
+	keys = list(encodings.keys())
+	rows = [ np.asarray(enc, dtype=np.float32).reshape(-1) for key in keys for enc in encodings[key] ]
+	offsets = np.cumsum([0] + [ len(encodings[key]) for key in keys ])
+
+	tmpPath = os.path.normpath(storePath) + ".tmp{}".format(os.getpid())
+	shutil.rmtree(tmpPath, ignore_errors=True)
+	os.makedirs(tmpPath)
+	matrix = np.lib.format.open_memmap(os.path.join(tmpPath, "encodings.npy"), mode="w+", dtype=np.float32, shape=(len(rows), len(rows[0]) if rows else 0))
+	for (i, row) in enumerate(rows):
+		matrix[i] = row
+	matrix.flush()
+	del matrix
+	np.save(os.path.join(tmpPath, "keys.npy"), np.array(keys))
+	np.save(os.path.join(tmpPath, "offsets.npy"), offsets.astype(np.int64))
+	np.save(os.path.join(tmpPath, "labels.npy"), np.repeat(np.arange(len(keys), dtype=np.int32), np.diff(offsets)))
+
+	#a previous (incomplete) store is replaced: os.replace moves a folder only onto a missing or empty one
+	if os.path.isdir(storePath):
+		shutil.rmtree(storePath)
+	os.replace(tmpPath, storePath)
+	print("[INFO] converted {} encodings of {} labels into: {}".format(len(rows), len(keys), storePath))
+	return EncodingStore(storePath)
+
+class EncodingStore:
+	# The class give access to a folder with a binary database of encodings, opened with np.memmap (nothing is read until it is used,
+	# and the pages are shared between all the processes that open the same store):
+	# - encodings.npy:	the (nEncodings, dim) float32 matrix, one encoding for each row, the rows of a label are consecutive
+	# - labels.npy:		for each row, the index (in keys) of its label
+	# - keys.npy:		the labels
+	# - offsets.npy:	the rows of the label keys[i] are: offsets[i]:offsets[i+1]
+
+	files = ("encodings", "labels", "keys", "offsets")
+
+	def __init__(self, storePath: str):
+		self.storePath = storePath
+		self._arrays = {}
+
+	def exists(self) -> bool:
+		""" Check if the (complete) store is on disk. """
+		return all( os.path.exists(os.path.join(self.storePath, name+".npy")) for name in self.files )
+
+	def _get(self, name: str) -> "np.ndarray":
+		if name not in self._arrays:
+			self._arrays[name] = np.load(os.path.join(self.storePath, name+".npy"), mmap_mode="r")
+		return self._arrays[name]
+
+	@property
+	def encodings(self) -> "np.memmap":
+		return self._get("encodings")
+
+	@property
+	def labels(self) -> "np.ndarray":
+		return self._get("labels")
+
+	@property
+	def keys(self) -> "np.ndarray":
+		return self._get("keys")
+
+	@property
+	def offsets(self) -> "np.ndarray":
+		return self._get("offsets")
+
+	def __len__(self) -> int:
+		return self.encodings.shape[0]
+
+	def dim(self) -> int:
+		""" Return the length of each encoding. """
+		return self.encodings.shape[1]
+
+	def encodingsOf(self, keyIndex: int) -> "np.ndarray":
+		""" Return the (view of the) encodings of the label keys[keyIndex]. """
+		return self.encodings[self.offsets[keyIndex] : self.offsets[keyIndex+1]]
+
 class DatabaseOfEncodings:
 	databasePath = {
 		#classifier: path of all the encodings
@@ -151,62 +333,61 @@ class DatabaseOfEncodings:
 		"resNet50":  "../imagesIn/negativePeople_dataset/resNet50_negativePeople_fullDataset.pkl"
 	}
 
-	def __init__(self, classifierType: str="resNet50"):
+	def __init__(self, classifierType: str="resNet50", storePath: str=None, seed: int=None):
+		""" 
+			The encodings are read from the binary EncodingStore at storePath (default: the pickle path with the .encdb extension).
+			If the store does not exist yet, it is created from the pickle the first time the encodings are needed.
+			seed: the seed of the random sampling of getNEncodings (None means not reproducible).
+		"""
 		if classifierType not in self.databasePath:
 			print("[INFO] Warning unknown classifier type...")
 		else:
 			#set main variables
 			self.classifier = classifierType
 			self.encodingsPath = self.databasePath[classifierType]
-
-			#load a dict with all the encodings of the NegativePeople dataset
-			self.encodings = pickle.loads(open(self.encodingsPath, "rb").read())
-			self.keys = list(self.encodings.keys())
-
-
-	def getNEncodings(self, n: int=1) -> "list of list":
-		""" This function take n encodings from the dataset (returned as a list of list) and remove them. """
-
-		#each run is independent from each other (there is only a global view)
-		#note: when all encodings are used this function become an empty loop
-		elements = []
-		for _ in range(n):
-			print("loop:", _)
-			#after ~5180 (518keys*10images per key) loops all will fall here
-			if len(self.keys)<=0:
-				print("No more elements")
-
-			else:
-				#get a random key position (lvl 1)
-				indxOut = random.randint(0, len(self.keys)-1)
-				#use self.keys to access an existing position (a person=out)
-				elOut = self.encodings[ self.keys[indxOut] ]
-
-				#get a random indx for the chosen person (lvl 2)
-				indxIn = random.randint(0, len(elOut)-1)
-				#get the image=in (feature vector) associated to the index
-				elIn = elOut[indxIn]	#this is the value to return
-				elements.append(elIn[0][0].tolist())
-
-				#remove the chosen image to do not pick it up twice
-				#move it to the last position and then reduce the list size
-				elOut[indxIn], elOut[-1] = elOut[-1], elOut[indxIn]	#easiest way to do a swap in python
-				self.encodings[ self.keys[indxOut]] = elOut[:-1] #delete the extracted element (In)
-
-				#if the list is empty now remove it also
-				if len(self.encodings[ self.keys[indxOut]])==0:
-					del self.encodings[ self.keys[indxOut]]	#delete from the dictionary
-					self.__removeKey(indxOut)				#delete from the existing keys
-		return elements
-
-	def __removeKey(self, i: int) -> None:
-		""" Remove the element at the position i, in the self.keys list. """
-		if 0<=i and i<len(self.keys):
-			#first move to the last position, and second reduce the list dimension
-			self.keys[i] = self.keys[-1]
-			self.keys = self.keys[:-1]
-
-		
-
-		
+			if storePath is None:
+				storePath = os.path.splitext(self.encodingsPath)[0] + ".encdb"
+			self.store = EncodingStore(storePath)
+
+			#the sampling order of the rows of the store (the store is opened lazily: at the first use)
+			self.seed = seed
+			self.order = None
+			self.nextPos = 0
+
+	def __open(self) -> None:
+		""" Open the store (converting the pickle if needed) and prepare the sampling order. """
+		if not self.store.exists():
+			convertPickleToStore(self.encodingsPath, self.store.storePath)
+		self.reset()
+
+	def reset(self, seed: int=None) -> None:
+		""" Make all the encodings available again, with a new random order (generated with the given seed or the one of the constructor). """
+		rng = np.random.default_rng(self.seed if seed is None else seed)
+		self.order = rng.permutation(len(self.store))	#a precomputed permutation of the rows: sampling is just moving forward
+		self.nextPos = 0
+
+	def remaining(self) -> int:
+		""" Return how many encodings can still be taken. """
+		if self.order is None:
+			self.__open()
+		return len(self.order) - self.nextPos
+
+	def getNEncodings(self, n: int=1, returnRows: bool=False) -> "np.ndarray or (np.ndarray, np.ndarray)":
+		""" 
+			This function take n random encodings from the dataset (returned as a contiguous (n, dim) matrix) and remove them.
+			When all the encodings are used less (or zero) rows are returned.
+			With returnRows also their rows in the store are returned (the ids of an IVFPQIndex.fromDatabase, see IVFPQIndex.remove).
+		"""
+		if self.order is None:
+			self.__open()
+
+		#each run is independent from each other (there is only a global view): an encoding is never taken twice
+		rows = self.order[self.nextPos : self.nextPos+n]
+		self.nextPos += len(rows)
+		if len(rows)<n:
+			print("No more elements (taken {} of {})".format(len(rows), n))
+
+		if returnRows:
+			return (self.store.encodings[rows], rows)
+		return self.store.encodings[rows]
 
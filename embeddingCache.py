@@ -0,0 +1,135 @@
+# import the necessary packages
+from collections import OrderedDict
+import numpy as np
+import time
+import cv2
+
+_popcount = np.array([ bin(i).count("1") for i in range(256) ], dtype=np.uint8)	#number of 1 bits of each byte
+
+def perceptualHash(crop: "image") -> int:
+	""" Return the 64 bits difference hash (dHash) of the image: similar images have hashes with a small Hamming distance. """
+	gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim==3 else crop
+	small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+	bits = (small[:, 1:] > small[:, :-1]).ravel()
+	return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def hammingDistances(h: int, hashes: "np.ndarray") -> "np.ndarray":
+	""" Return the number of different bits between the hash h and each of the (uint64) hashes. """
+	xor = np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.uint64(h))
+	return _popcount[xor.view(np.uint8)].reshape(len(xor), 8).sum(axis=1)
+
+class _Entry:
+	__slots__ = ("encoding", "hash", "frame", "time")
+	def __init__(self, encoding: "np.ndarray", h: int, frame: int, now: float):
+		self.encoding = encoding
+		self.hash = h				#the perceptual hash of the crop that was encoded
+		self.frame = frame			#the frame when it was encoded
+		self.time = now				#the time when it was last used (for the ttl)
+
+class EmbeddingCache:
+	# The class keep the encodings of the last crops, so an object seen in consecutive frames is encoded only again when needed.
+	# The key of an encoding is the track id (see Tracker) or, without it, the perceptual hash of the crop: by default only the same
+	# hash is a hit, since a dHash is too coarse to tell people apart (with maxDistance>0 a near hash can return another person's
+	# encoding: use it only when the crops are known to be of the same object). A track encoding is refreshed every refreshEvery
+	# frames or when the appearance of the crop drifts (more than maxDrift different bits). The entries are evicted as least
+	# recently used (maxEntries) or after ttl seconds.
+
+	def __init__(self, maxEntries: int=1024, ttl: float=None, refreshEvery: int=30, maxDrift: int=10, maxDistance: int=0):
+		"""
+		Initialization function of the EmbeddingCache class.
+
+		Parameters:
+		maxEntries (int):		The maximum number of cached encodings.
+		ttl (float):			The seconds after which an unused encoding is evicted (None means never).
+		refreshEvery (int):		The number of frames after which the encoding of a track is computed again (None means never).
+		maxDrift (int):			The maximum Hamming distance between the hash of the crop and the cached one of a track (0..64).
+		maxDistance (int):		The maximum Hamming distance of a hit for the crops without a track id (0..64, 0 means the same hash).
+		"""
+		self.maxEntries = maxEntries
+		self.ttl = ttl
+		self.refreshEvery = refreshEvery
+		self.maxDrift = maxDrift
+		self.maxDistance = maxDistance
+		self.frame = 0
+		self._tracks = OrderedDict()		#track id -> _Entry, the last used at the end
+		self._hashes = OrderedDict()		#hash -> _Entry, the last used at the end
+		self.hits = 0
+		self.misses = 0
+		self.refreshes = 0				#misses of a cached track because it is too old or its appearance drifted
+		self.evictions = 0
+
+	### Public functions
+	def nextFrame(self) -> None:
+		""" Advance the frame counter (used by refreshEvery) and evict the expired entries. """
+		self.frame += 1
+		if self.ttl is not None:
+			deadline = time.monotonic() - self.ttl
+			for entries in (self._tracks, self._hashes):
+				while len(entries)>0 and next(iter(entries.values())).time < deadline:
+					entries.popitem(last=False)
+					self.evictions += 1
+
+	def lookup(self, h: int, trackId: "int"=None) -> "np.ndarray or None":
+		""" Return the cached encoding of the track (or of the crop with hash h, if trackId is None), None if it must be computed. """
+		if trackId is not None:
+			entry = self._tracks.get(trackId)
+			if entry is not None and not self._valid(entry, h):
+				self.refreshes += 1
+				entry = None
+			key = trackId
+			entries = self._tracks
+		else:
+			key = self._nearest(h)
+			entries = self._hashes
+			entry = None if key is None else entries[key]
+
+		if entry is None:
+			self.misses += 1
+			return None
+		self.hits += 1
+		entry.time = time.monotonic()
+		entries.move_to_end(key)
+		return entry.encoding
+
+	def store(self, h: int, encoding: "np.ndarray", trackId: "int"=None) -> None:
+		""" Cache the encoding of the crop with hash h (and of the track, if given). """
+		entries = self._hashes if trackId is None else self._tracks
+		key = h if trackId is None else trackId
+		entries[key] = _Entry(encoding, h, self.frame, time.monotonic())
+		entries.move_to_end(key)
+		while len(self._tracks) + len(self._hashes) > self.maxEntries:
+			#evict the least recently used of the bigger of the two
+			if len(self._tracks) >= len(self._hashes):
+				self._tracks.popitem(last=False)
+			else:
+				self._hashes.popitem(last=False)
+			self.evictions += 1
+
+	def stats(self) -> dict:
+		""" Return the hits, misses (and refreshes among them), hit rate, evictions and cached encodings. """
+		total = self.hits + self.misses
+		return { "hits": self.hits, "misses": self.misses, "refreshes": self.refreshes, "hitRate": self.hits/total if total>0 else 0.0,
+				 "evictions": self.evictions, "entries": len(self._tracks) + len(self._hashes) }
+
+	def clear(self) -> None:
+		""" Empty the cache (the statistics are kept). """
+		self._tracks.clear()
+		self._hashes.clear()
+
+	### Private functions
+	def _valid(self, entry: _Entry, h: int) -> bool:
+		""" If the cached encoding of a track can still be used for a crop with hash h. """
+		if self.refreshEvery is not None and self.frame - entry.frame >= self.refreshEvery:
+			return False
+		return bin(h ^ entry.hash).count("1") <= self.maxDrift
+
+	def _nearest(self, h: int) -> "int or None":
+		""" Return the cached hash nearest to h (within maxDistance), None if there is none. """
+		if h in self._hashes:
+			return h
+		if len(self._hashes)==0 or self.maxDistance<=0:
+			return None
+		keys = np.fromiter(self._hashes.keys(), dtype=np.uint64, count=len(self._hashes))
+		distances = hammingDistances(h, keys)
+		best = int(np.argmin(distances))
+		return int(keys[best]) if distances[best] <= self.maxDistance else None
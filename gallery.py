@@ -0,0 +1,359 @@
+# import the necessary packages
+import numpy as np
+
+from dataset import convertPickleToStore
+
+################################################################################################################
+############################     Gallery Search             ####################################################
+################################################################################################################
+class GallerySearch:
+	# The class rank a gallery of encodings against one (or a batch of) query encodings, with a single matrix multiplication.
+	# The results are the (label, path) tuples used by gridView.createGrid.
+
+	def __init__(self, encodings: "np.ndarray", labelsAndPaths: "list of couple", metric: str="cosine"):
+		"""
+		Initialization function of the GallerySearch class.
+
+		Parameters:
+		encodings (np.ndarray):		The (n, d) matrix of the gallery encodings (or a list of n encodings).
+		labelsAndPaths (list):		The n (label, path) couples associated to the encodings (the path can be None).
+		metric (str):				"cosine" (similarity, higher is better) or "l2" (distance, lower is better).
+		"""
+		if metric not in ("cosine", "l2"):
+			raise ValueError("Unknown metric: {} (use 'cosine' or 'l2')".format(metric))
+		if len(encodings)!=len(labelsAndPaths):
+			raise ValueError("The number of encodings ({}) and labels ({}) differ".format(len(encodings), len(labelsAndPaths)))
+
+		self.metric = metric
+		self.labelsAndPaths = list(labelsAndPaths)
+		self.matrix = self._prepare(np.asarray(encodings, dtype=np.float32))
+		#the squared norms of the gallery, for the l2 distance: |q-x|^2 = |q|^2 - 2q.x + |x|^2
+		self.sqNorms = np.einsum("ij,ij->i", self.matrix, self.matrix) if metric=="l2" else None
+
+	@classmethod
+	def fromDatabase(cls, database: "DatabaseOfEncodings", paths: list=None, metric: str="cosine") -> "GallerySearch":
+		""" Create the gallery with all the encodings of a DatabaseOfEncodings (the paths are None if not given). """
+		store = database.store
+		if not store.exists():
+			convertPickleToStore(database.encodingsPath, store.storePath)
+		keys = store.keys.tolist()
+		labels = [ keys[i] for i in store.labels ]
+		paths = [None]*len(labels) if paths is None else paths
+		return cls(store.encodings, list(zip(labels, paths)), metric)
+
+	### Public functions
+	def __len__(self) -> int:
+		return self.matrix.shape[0]
+
+	def search(self, queries: "np.ndarray", k: int=10) -> ("np.ndarray", "np.ndarray"):
+		"""
+			Return the (nQueries, k) indexes of the best gallery entries for each query (best first) and their scores
+			(cosine similarity or l2 distance). queries can be a single encoding or a (nQueries, d) matrix.
+		"""
+		queries = self._prepare(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+		k = min(k, len(self))
+
+		scores = queries @ self.matrix.T
+		if self.metric=="l2":
+			#distances (lower is better), the norm of the query does not change the ranking but it is added to return true distances
+			scores = np.maximum(np.einsum("ij,ij->i", queries, queries)[:, None] - 2*scores + self.sqNorms[None, :], 0)
+			keys = scores
+		else:
+			keys = -scores
+
+		#select the k best in linear time, then sort only them
+		idxs = np.argpartition(keys, k-1, axis=1)[:, :k] if k<len(self) else np.tile(np.arange(len(self)), (len(queries), 1))
+		order = np.argsort(np.take_along_axis(keys, idxs, axis=1), axis=1)
+		idxs = np.take_along_axis(idxs, order, axis=1)
+		scores = np.take_along_axis(scores, idxs, axis=1)
+		if self.metric=="l2":
+			scores = np.sqrt(scores)
+		return (idxs, scores)
+
+	def query(self, query: "np.ndarray", k: int=10) -> "list of tuples":
+		""" Return the k (label, path) tuples of the gallery most similar to the query encoding (best first). """
+		return self.queryBatch(query, k)[0]
+
+	def queryBatch(self, queries: "np.ndarray", k: int=10) -> "list of list of tuples":
+		""" Return, for each query encoding, the k (label, path) tuples of the gallery most similar to it (best first). """
+		(idxs, _) = self.search(queries, k)
+		return [ [ self.labelsAndPaths[i] for i in row ] for row in idxs.tolist() ]
+
+	### Private functions
+	def _prepare(self, matrix: "np.ndarray") -> "np.ndarray":
+		""" Normalize the rows of the matrix (only for the cosine metric). """
+		if self.metric=="cosine":
+			norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+			matrix = matrix / np.maximum(norms, 1e-12)
+		return np.ascontiguousarray(matrix)
+
+################################################################################################################
+############################     Approximate Index (IVF-PQ)     ################################################
+################################################################################################################
+def _nearest(data: "np.ndarray", centroids: "np.ndarray", chunk: int=65536) -> ("np.ndarray", "np.ndarray"):
+	""" Return, for each row of data, the index of the nearest centroid (l2) and the squared distance to it. """
+	cNorms = np.einsum("ij,ij->i", centroids, centroids)
+	assign = np.empty(len(data), dtype=np.int64)
+	dists = np.empty(len(data), dtype=np.float32)
+	for start in range(0, len(data), chunk):
+		part = data[start : start+chunk]
+		d = cNorms[None, :] - 2 * (part @ centroids.T)		#|x|^2 is constant for each row: not needed for the argmin
+		assign[start : start+chunk] = np.argmin(d, axis=1)
+		dists[start : start+chunk] = d[np.arange(len(part)), assign[start : start+chunk]] + np.einsum("ij,ij->i", part, part)
+	return (assign, np.maximum(dists, 0))
+
+def kmeans(data: "np.ndarray", k: int, nIter: int=20, seed: int=0) -> "np.ndarray":
+	""" A plain (Lloyd) k-means: return the (k, d) centroids of the data. """
+	rng = np.random.default_rng(seed)
+	data = np.asarray(data, dtype=np.float32)
+	k = min(k, len(data))
+	centroids = data[rng.choice(len(data), k, replace=False)].copy()
+
+	for _ in range(nIter):
+		(assign, _) = _nearest(data, centroids)
+		#sum the points of each cluster (sorting them by cluster is much faster than np.add.at)
+		order = np.argsort(assign, kind="stable")
+		counts = np.bincount(assign, minlength=k)
+		nonEmpty = counts>0
+		starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonEmpty]
+		centroids[nonEmpty] = np.add.reduceat(data[order], starts, axis=0) / counts[nonEmpty, None]
+		#the empty clusters restart from random points
+		if not nonEmpty.all():
+			centroids[~nonEmpty] = data[rng.choice(len(data), (~nonEmpty).sum(), replace=False)]
+	return centroids
+
+def _npzPath(path: str) -> str:
+	""" Return the path with the .npz extension (added by np.savez when missing). """
+	return path if path.endswith(".npz") else path + ".npz"
+
+class IVFPQIndex:
+	# Approximate nearest neighbour index for large galleries (inverted file with product quantization):
+	# - a coarse k-means quantizer split the gallery in nList inverted lists
+	# - the residual of each encoding (encoding - centroid of its list) is compressed in m bytes (one code for each of the m sub-vectors)
+	# - a query visits only the nProbe nearest lists and compute the distances with m look-ups for each candidate:
+	#   |q - c - r|^2 = |q - c|^2 - 2 q.r + (|r|^2 + 2 c.r), the look-up table of q.r is computed once for each query and
+	#   the last term (that does not depend on the query) once for each encoding when it is added.
+	# The ids are integers chosen by the user (by default: the rows of the EncodingStore).
+
+	def __init__(self, nList: int=256, m: int=16, nBits: int=8, metric: str="cosine", nProbe: int=8, seed: int=0,
+			  trainSize: int=50000, chunkSize: int=65536):
+		"""
+		Initialization function of the IVFPQIndex class.
+
+		Parameters:
+		nList (int):	The number of inverted lists (coarse centroids).
+		m (int):		The number of sub-vectors of each encoding (must divide its length): the bytes used for each encoding.
+		nBits (int):	The bits of each sub-vector code (at most 8: 256 centroids for each sub-quantizer).
+		metric (str):	"cosine" (the encodings are normalized) or "l2".
+		nProbe (int):	The default number of lists visited by a query (more lists: better recall, higher latency).
+		seed (int):		The seed of the k-means initializations (and of the training sample).
+		trainSize (int):	The maximum number of encodings (a random sample) used by train.
+		chunkSize (int):	The number of encodings prepared and encoded at once by add (bounds the memory used for big galleries).
+		"""
+		if metric not in ("cosine", "l2"):
+			raise ValueError("Unknown metric: {} (use 'cosine' or 'l2')".format(metric))
+		if nBits>8:
+			raise ValueError("At most 8 bits for each code (got {})".format(nBits))
+		self.nList = nList
+		self.m = m
+		self.nBits = nBits
+		self.metric = metric
+		self.nProbe = nProbe
+		self.seed = seed
+		self.trainSize = trainSize
+		self.chunkSize = chunkSize
+
+		self.coarse = None			#(nList, d) coarse centroids
+		self.codebooks = None		#(m, 2^nBits, d/m) centroids of each sub-quantizer
+		self.listIds = None			#for each list: the ids of its encodings
+		self.listCodes = None		#for each list: the (n, m) uint8 codes of its encodings
+		self.listTerms = None		#for each list: the (n,) |r|^2 + 2c.r of its encodings (r: the quantized residual, c: the centroid)
+		self.location = {}			#id -> list that contains it
+		self.nextId = 0				#the first id assigned by add when the ids are not given
+		self.labelsAndPaths = None	#optional: id -> (label, path), used by query and queryBatch
+
+	@classmethod
+	def fromDatabase(cls, database: "DatabaseOfEncodings", paths: list=None, **kwargs) -> "IVFPQIndex":
+		""" 
+			Train the index on (a sample of) the encodings of a DatabaseOfEncodings and add all of them (the ids are the rows of its store).
+			The store is memory mapped: only the sampled rows and one chunk at a time are read.
+		"""
+		store = database.store
+		if not store.exists():
+			convertPickleToStore(database.encodingsPath, store.storePath)
+		index = cls(**kwargs)
+		index.train(store.encodings)
+		index.add(store.encodings)
+		keys = store.keys.tolist()
+		labels = [ keys[i] for i in store.labels ]
+		index.labelsAndPaths = list(zip(labels, [None]*len(labels) if paths is None else paths))
+		return index
+
+	### Public functions
+	def __len__(self) -> int:
+		return len(self.location)
+
+	def train(self, encodings: "np.ndarray", nIter: int=20) -> None:
+		""" Learn the coarse quantizer and the sub-quantizers from a random sample of (at most trainSize) encodings. """
+		if len(encodings) > self.trainSize:
+			rng = np.random.default_rng(self.seed)
+			encodings = encodings[np.sort(rng.choice(len(encodings), self.trainSize, replace=False))]	#sorted: sequential reads of a memmap
+		data = self._prepare(encodings)
+		(n, d) = data.shape
+		if d % self.m != 0:
+			raise ValueError("The encoding length ({}) is not a multiple of m ({})".format(d, self.m))
+
+		self.coarse = kmeans(data, self.nList, nIter, self.seed)
+		self.nList = len(self.coarse)
+		(assign, _) = _nearest(data, self.coarse)
+		residuals = data - self.coarse[assign]
+
+		sub = d // self.m
+		self.codebooks = np.stack([ kmeans(residuals[:, j*sub : (j+1)*sub], 2**self.nBits, nIter, self.seed+j+1) for j in range(self.m) ])
+		self.listIds = [ np.empty(0, dtype=np.int64) for _ in range(self.nList) ]
+		self.listCodes = [ np.empty((0, self.m), dtype=np.uint8) for _ in range(self.nList) ]
+		self.listTerms = [ np.empty(0, dtype=np.float32) for _ in range(self.nList) ]
+		self.location = {}
+
+	def add(self, encodings: "np.ndarray", ids: "np.ndarray"=None) -> None:
+		""" 
+			Add the encodings to the index (ids default: the next integers after the ones already added).
+			The ids must be unique: an id already in the index (or repeated in ids) raise a ValueError (remove it first to replace it).
+			The encodings are processed in chunks of chunkSize (only one chunk is copied in memory at a time).
+		"""
+		if ids is None:
+			ids = np.arange(self.nextId, self.nextId+len(encodings))
+		ids = np.asarray(ids, dtype=np.int64)
+		if len(ids)!=len(encodings):
+			raise ValueError("The number of ids ({}) is not the number of encodings ({})".format(len(ids), len(encodings)))
+		(unique, counts) = np.unique(ids, return_counts=True)
+		duplicates = [ i for i in unique.tolist() if i in self.location ] + unique[counts>1].tolist()
+		if len(duplicates)>0:
+			raise ValueError("Duplicate ids (already in the index or repeated): {}".format(sorted(set(duplicates))[:10]))
+		if len(ids)>0:
+			self.nextId = max(self.nextId, int(ids.max())+1)
+
+		for start in range(0, len(ids), self.chunkSize):
+			self._addChunk(self._prepare(encodings[start : start+self.chunkSize]), ids[start : start+self.chunkSize])
+
+	def remove(self, ids: "list of int") -> int:
+		""" 
+			Remove the given ids, return how many were found.
+			To mirror the sampling of a DatabaseOfEncodings (index built with fromDatabase) remove the rows it returns:
+			(encodings, rows) = database.getNEncodings(n, returnRows=True); index.remove(rows)
+		"""
+		byList = {}
+		for i in ids:
+			l = self.location.pop(int(i), None)
+			if l is not None:
+				byList.setdefault(l, []).append(int(i))
+		for (l, removed) in byList.items():
+			keep = ~np.isin(self.listIds[l], removed)
+			self.listIds[l] = self.listIds[l][keep]
+			self.listCodes[l] = self.listCodes[l][keep]
+			self.listTerms[l] = self.listTerms[l][keep]
+		return sum(len(removed) for removed in byList.values())
+
+	def search(self, queries: "np.ndarray", k: int=10, nProbe: int=None) -> ("np.ndarray", "np.ndarray"):
+		""" 
+			Return the (nQueries, k) approximate best ids for each query (best first) and their estimated squared l2 distances.
+			If a query finds less than k candidates the missing ids are -1 (with infinite distance).
+		"""
+		queries = self._prepare(np.atleast_2d(queries))
+		nProbe = min(self.nProbe if nProbe is None else nProbe, self.nList)
+		sub = queries.shape[1] // self.m
+
+		#the nProbe lists nearest to each query (|q - c|^2)
+		coarseDists = np.einsum("ij,ij->i", self.coarse, self.coarse)[None, :] - 2 * (queries @ self.coarse.T)
+		coarseDists += np.einsum("ij,ij->i", queries, queries)[:, None]
+		#look-up tables of all the queries: the dot product of each sub-vector with each centroid of its sub-quantizer
+		luts = np.einsum("qms,mks->qmk", queries.reshape(len(queries), self.m, sub), self.codebooks)	#(queries, m, 2^nBits)
+		probes = np.argpartition(coarseDists, nProbe-1, axis=1)[:, :nProbe] if nProbe<self.nList else np.tile(np.arange(self.nList), (len(queries), 1))
+
+		allIds = np.full((len(queries), k), -1, dtype=np.int64)
+		allDists = np.full((len(queries), k), np.inf, dtype=np.float32)
+		for (qi, query) in enumerate(queries):
+			lists = [ l for l in probes[qi] if len(self.listIds[l])>0 ]
+			if len(lists)==0:
+				continue
+			codes = np.concatenate([ self.listCodes[l] for l in lists ])
+			ids = np.concatenate([ self.listIds[l] for l in lists ])
+			terms = np.concatenate([ self.listTerms[l] for l in lists ])
+			probeOf = np.repeat(np.asarray(lists), [ len(self.listIds[l]) for l in lists ])
+			dists = coarseDists[qi, probeOf] + terms - 2 * luts[qi, np.arange(self.m)[None, :], codes].sum(axis=1)
+
+			kk = min(k, len(ids))
+			best = np.argpartition(dists, kk-1)[:kk] if kk<len(ids) else np.arange(len(ids))
+			best = best[np.argsort(dists[best])]
+			allIds[qi, :kk] = ids[best]
+			allDists[qi, :kk] = dists[best]
+		return (allIds, allDists)
+
+	def query(self, query: "np.ndarray", k: int=10, nProbe: int=None) -> "list of tuples":
+		""" Return the k (label, path) tuples (see labelsAndPaths) approximately most similar to the query encoding. """
+		return self.queryBatch(query, k, nProbe)[0]
+
+	def queryBatch(self, queries: "np.ndarray", k: int=10, nProbe: int=None) -> "list of list of tuples":
+		""" Return, for each query encoding, the k (label, path) tuples (see labelsAndPaths) approximately most similar to it. """
+		(ids, _) = self.search(queries, k, nProbe)
+		return [ [ self.labelsAndPaths[i] for i in row if i>=0 ] for row in ids.tolist() ]
+
+	def save(self, path: str) -> None:
+		""" Save the index in a single .npz file (the extension is added to the path if missing, as load does). """
+		lengths = np.array([ len(ids) for ids in self.listIds ], dtype=np.int64)
+		np.savez(_npzPath(path), 
+			params=np.array([self.nList, self.m, self.nBits, self.nProbe, self.seed]), metric=np.array(self.metric),
+			coarse=self.coarse, codebooks=self.codebooks, lengths=lengths,
+			ids=np.concatenate(self.listIds), codes=np.concatenate(self.listCodes))
+
+	@classmethod
+	def load(cls, path: str) -> "IVFPQIndex":
+		""" Load an index saved with save (the labelsAndPaths are not saved), the .npz extension can be omitted. """
+		data = np.load(_npzPath(path))
+		(nList, m, nBits, nProbe, seed) = data["params"].tolist()
+		index = cls(nList, m, nBits, str(data["metric"]), nProbe, seed)
+		index.coarse = data["coarse"]
+		index.codebooks = data["codebooks"]
+		bounds = np.concatenate([[0], np.cumsum(data["lengths"])])
+		(ids, codes) = (data["ids"], data["codes"])
+		index.listIds = [ ids[bounds[l] : bounds[l+1]] for l in range(nList) ]
+		index.listCodes = [ codes[bounds[l] : bounds[l+1]] for l in range(nList) ]
+		index.listTerms = [ index._terms(index.listCodes[l], np.full(len(index.listCodes[l]), l)) for l in range(nList) ]
+		index.location = { i: l for l in range(nList) for i in index.listIds[l].tolist() }
+		index.nextId = int(ids.max())+1 if len(ids)>0 else 0
+		return index
+
+	### Private functions
+	def _addChunk(self, data: "np.ndarray", ids: "np.ndarray") -> None:
+		""" Assign the (prepared) encodings to their lists and append their codes. """
+		(assign, _) = _nearest(data, self.coarse)
+		codes = self._encode(data - self.coarse[assign])
+		terms = self._terms(codes, assign)
+		order = np.argsort(assign, kind="stable")
+		bounds = np.searchsorted(assign[order], np.arange(self.nList+1))
+		for l in np.flatnonzero(np.diff(bounds)):
+			rows = order[bounds[l] : bounds[l+1]]
+			self.listIds[l] = np.concatenate([self.listIds[l], ids[rows]])
+			self.listCodes[l] = np.concatenate([self.listCodes[l], codes[rows]])
+			self.listTerms[l] = np.concatenate([self.listTerms[l], terms[rows]])
+		self.location.update(zip(ids.tolist(), assign.tolist()))
+
+	def _prepare(self, encodings: "np.ndarray") -> "np.ndarray":
+		""" Convert to a float32 matrix (normalizing the rows for the cosine metric). """
+		data = np.asarray(encodings, dtype=np.float32)
+		if self.metric=="cosine":
+			data = data / np.maximum(np.linalg.norm(data, axis=1, keepdims=True), 1e-12)
+		return data
+
+	def _terms(self, codes: "np.ndarray", lists: "np.ndarray") -> "np.ndarray":
+		""" Return |r|^2 + 2c.r for each encoding: r is its quantized residual (from the codes), c the centroid of its list. """
+		residuals = np.concatenate([ self.codebooks[j][codes[:, j]] for j in range(self.m) ], axis=1)
+		return (np.einsum("ij,ij->i", residuals, residuals) + 2 * np.einsum("ij,ij->i", self.coarse[lists], residuals)).astype(np.float32)
+
+	def _encode(self, residuals: "np.ndarray") -> "np.ndarray":
+		""" Product quantization: the (n, m) codes of the residuals. """
+		sub = residuals.shape[1] // self.m
+		codes = np.empty((len(residuals), self.m), dtype=np.uint8)
+		for j in range(self.m):
+			(codes[:, j], _) = _nearest(np.ascontiguousarray(residuals[:, j*sub : (j+1)*sub]), self.codebooks[j])
+		return codes
@@ -3,6 +3,8 @@ from imutils import resize
 import numpy as np
 import cv2
 
+from imageLoader import sharedLoader
+
 ############################   Utils   #########################################################################
 def fill(image, width=None, height=None) -> "img":
 	""" 
@@ -66,20 +68,91 @@ def assembleGrid(images: "list of images", x: int, y: int) -> "image":
 
 	return(grid)
 
-def createGrid(topK: "list of tuples", x: int, y: int, resize=False) -> "image":
+def letterboxInto(image, slot, type: int=None, position: str="") -> "image":
+	""" 
+		Resize the image (keeping its ratio) directly inside the slot (a view of a bigger image), exactly as fill does: 
+		the image is at the top left corner and the remaining area is black.
+		If type is given the border and position (see drawBorderAndPos) are drawn before the resize, as createGrid does.
+		Return the view of the slot that contains the image.
+	"""
+	(hSlot, wSlot) = slot.shape[:2]
+	(h, w) = image.shape[:2]
+	#the same sizes of fill (imutils.resize truncates the resized dimension)
+	if wSlot / w < hSlot / h:
+		(wNew, hNew) = (wSlot, int(h * (wSlot / w)))
+	else:
+		(wNew, hNew) = (int(w * (hSlot / h)), hSlot)
+
+	slot[hNew:, :] = 0
+	slot[:hNew, wNew:] = 0
+	dst = slot[:hNew, :wNew]
+	if (hNew, wNew)==(h, w):
+		dst[...] = image
+		if type is not None:
+			drawBorderAndPos(dst, type, position)	#in place: no copy of the image
+	else:
+		if type is not None:
+			image = drawBorderAndPos(image.copy(), type, position)
+		#resize into a temporary image only if opencv cannot write directly into the view (non contiguous rows are fine)
+		out = cv2.resize(image, (wNew, hNew), dst=dst, interpolation=cv2.INTER_AREA)
+		if not np.shares_memory(out, dst):
+			dst[...] = out
+	return dst
+
+def composeGrid(images: "list of images", x: int, y: int, tileSize: tuple=None, types: list=None, positions: list=None, canvas=None) -> "image":
+	""" 
+		Compose the grid x*y of the images writing each one directly in its slot of a single output image (the canvas), 
+		instead of concatenating rows and columns. 
+		- tileSize: the (width, height) of each slot, if None the biggest dimensions of the images are used
+		- types and positions: if given the border and position of each image are drawn (see drawBorderAndPos), before the 
+		  resize as createGrid with resize=True does, so the two grids are the same
+		- canvas: an image returned by a previous call, reused if it has the right shape (no new allocation)
+		If there are less than x*y images the last slots are left blank.
+	"""
+	if tileSize is None:
+		tileSize = (max(img.shape[1] for img in images), max(img.shape[0] for img in images))
+	(wTile, hTile) = tileSize
+	shape = (y*hTile, x*wTile, 3)
+	if canvas is None or canvas.shape!=shape or canvas.dtype!=np.uint8:
+		canvas = np.empty(shape, dtype=np.uint8)
+
+	for i in range(x*y):
+		(r, c) = divmod(i, x)
+		slot = canvas[r*hTile : (r+1)*hTile, c*wTile : (c+1)*wTile]
+		if i >= len(images) or images[i] is None:
+			slot[...] = 0	#blank tile
+			continue
+
+		letterboxInto(images[i], slot, None if types is None else types[i], "" if positions is None else positions[i])
+	return canvas
+
+def createGrid(topK: "list of tuples", x: int, y: int, resize=False, loader: "ImageLoader"=None, singleBuffer: bool=False, canvas=None) -> "image":
 	"""  
 		Given a list of n tuples (label, path of an image) where the first tuple represent the query image.
 		X and y where (where n=x*y) create the representation grid.
 		Resize can be set if the input images does not have all the same shape.
+		The images are loaded (in parallel and with cache) by the given ImageLoader, the shared one if None.
+		With singleBuffer the grid is composed in a single preallocated image (see composeGrid): the images are always 
+		resized to the biggest dimensions, n can be less than x*y and the canvas of a previous call can be reused.
 	"""
+	if loader is None:
+		loader = sharedLoader
 	queryLabel = topK[0][0]
 	imgs = []
 
 	hMax = 0
 	wMax = 0
-	for (pos, (label, path)) in enumerate(topK):
-		#for each image: load and draw border
-		img = cv2.imread(path)
+	loaded = loader.readMany([ path for (_, path) in topK ])
+
+	if singleBuffer:
+		#query=blue without position, the others green (same label of the query) or red
+		types = [0] + [ 1 if label==queryLabel else -1 for (label, _) in topK[1:] ]
+		positions = [""] + [ str(pos) for pos in range(1, len(topK)) ]
+		return composeGrid(loaded, x, y, types=types, positions=positions, canvas=canvas)
+
+	for (pos, ((label, path), img)) in enumerate(zip(topK, loaded)):
+		#for each image: copy (the loaded images are shared with the cache) and draw border
+		img = img.copy()
 		img = drawBorderAndPos(img, 1 if label==queryLabel else -1, str(pos))
 		imgs.append(img)
 		
@@ -95,7 +168,6 @@ def createGrid(topK: "list of tuples", x: int, y: int, resize=False) -> "image":
 	if resize:
 		filledImgs = []
 		for img in imgs:
-			print(img.shape[:2])
 			filledImgs.append( fill(img, wMax, hMax) )
 		imgs = filledImgs
 	
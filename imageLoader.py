@@ -0,0 +1,114 @@
+# import the necessary packages
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from threading import Lock
+import cv2
+import os
+
+class ImageLoader:
+	# The class load (decode) images from disk with a pool of threads and keep the most recent ones in a bounded LRU cache.
+	# The cache key is the couple (path, modification time), so a modified file is loaded again.
+	# NB: the returned images are shared with the cache, so they are read-only (use .copy() before drawing on them).
+
+	def __init__(self, maxBytes: int=512*1024*1024, nThreads: int=8):
+		"""
+		Initialization function of the ImageLoader class.
+
+		Parameters:
+		maxBytes (int):		The maximum memory (in bytes) of the decoded images kept in the cache (0 disable the cache).
+		nThreads (int):		The number of threads used to load the images of readMany.
+		"""
+		self.maxBytes = maxBytes
+		self.nThreads = nThreads
+		self._pool = None
+		self._cache = OrderedDict()		#(path, mtime) -> image, the last used at the end
+		self._bytes = 0
+		self._lock = Lock()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	### Public functions
+	def read(self, path: str) -> "image":
+		""" Return the image at the given path (None if it cannot be read). """
+		key = self._key(path)
+		image = self._get(key)
+		if image is None:
+			image = self._load(key)
+		return image
+
+	def readMany(self, paths: "list of str") -> "list of images":
+		""" Return the images at the given paths (in the same order), the ones not in the cache are loaded in parallel. """
+		keys = [ self._key(path) for path in paths ]
+		images = [ self._get(key) for key in keys ]
+		missing = [ i for (i, image) in enumerate(images) if image is None ]
+
+		if len(missing)>1 and self.nThreads>1:
+			if self._pool is None:
+				self._pool = ThreadPoolExecutor(max_workers=self.nThreads)	#cv2.imread release the GIL while decoding
+			loaded = list(self._pool.map(self._load, [ keys[i] for i in missing ]))
+		else:
+			loaded = [ self._load(keys[i]) for i in missing ]
+
+		for (i, image) in zip(missing, loaded):
+			images[i] = image
+		return images
+
+	def stats(self) -> dict:
+		""" Return the statistics of the cache: hits, misses, hit rate, evictions, cached images and their memory (bytes). """
+		with self._lock:
+			total = self.hits + self.misses
+			return { "hits": self.hits, "misses": self.misses, "hitRate": self.hits/total if total>0 else 0.0,
+					 "evictions": self.evictions, "images": len(self._cache), "bytes": self._bytes }
+
+	def clear(self) -> None:
+		""" Empty the cache (the statistics are kept). """
+		with self._lock:
+			self._cache.clear()
+			self._bytes = 0
+
+	def release(self) -> None:
+		""" Empty the cache and stop the threads. """
+		self.clear()
+		if self._pool is not None:
+			self._pool.shutdown()
+			self._pool = None
+
+	### Private functions
+	def _key(self, path: str) -> tuple:
+		try:
+			return (path, os.stat(path).st_mtime)
+		except OSError:
+			return (path, None)		#missing file: never cached
+
+	def _get(self, key: tuple) -> "image or None":
+		""" Return the cached image (marking it as the most recently used), or None. """
+		with self._lock:
+			image = self._cache.get(key)
+			if image is None:
+				self.misses += 1
+			else:
+				self.hits += 1
+				self._cache.move_to_end(key)
+			return image
+
+	def _load(self, key: tuple) -> "image or None":
+		""" Decode the image and (if possible) put it in the cache, evicting the least recently used images. """
+		image = cv2.imread(key[0])
+		if image is None or key[1] is None or image.nbytes > self.maxBytes:
+			return image
+
+		image.flags.writeable = False	#the cached images are shared: protect them from in place modifications
+		with self._lock:
+			if key not in self._cache:
+				self._cache[key] = image
+				self._bytes += image.nbytes
+			while self._bytes > self.maxBytes:
+				(_, old) = self._cache.popitem(last=False)
+				self._bytes -= old.nbytes
+				self.evictions += 1
+		return image
+
+
+# The loader shared by gridView and the Dataset classes
+sharedLoader = ImageLoader()
@@ -0,0 +1,195 @@
+# import the necessary packages
+from multiprocessing import shared_memory
+import multiprocessing as mp
+import numpy as np
+import traceback
+import queue
+import time
+import cv2
+
+############################   Worker process   ###############################################################
+def _worker(workerId: int, modelClass: type, modelKwargs: dict, slotNames: list, taskQueue, resultQueue, threadsPerWorker: int) -> None:
+	""" The body of a worker process: load its own copy of the model and process the tasks until the None task arrive. """
+	#each worker is already one of nWorkers parallel processes: without a limit each one would start a thread for each cpu
+	if threadsPerWorker is not None:
+		cv2.setNumThreads(threadsPerWorker)
+	slots = [ shared_memory.SharedMemory(name=name) for name in slotNames ]
+	try:
+		model = modelClass(**modelKwargs)
+	except Exception:
+		resultQueue.put((None, workerId, None, 0.0, traceback.format_exc()))
+		model = None
+
+	while model is not None:
+		task = taskQueue.get()
+		if task is None:
+			break
+
+		(taskId, slotIndex, metas, confidence) = task
+		#the images are read directly from the shared memory (no copy, no pickling)
+		images = [ np.ndarray(shape, dtype=dtype, buffer=slots[slotIndex].buf, offset=offset) for (offset, shape, dtype) in metas ]
+		start = time.perf_counter()
+		try:
+			if len(images)==1:
+				out = [ model.feed(images[0], confidence) ]
+			else:
+				out = model.feedBatch(images, confidence)
+			resultQueue.put((taskId, workerId, out, time.perf_counter()-start, None))
+		except Exception:
+			resultQueue.put((taskId, workerId, None, time.perf_counter()-start, traceback.format_exc()))
+		del images	#release the views before closing the shared memory
+
+	for slot in slots:
+		slot.close()
+
+################################################################################################################
+############################     Inference Engine           ####################################################
+################################################################################################################
+class InferenceEngine:
+	# The class spread images (or batches of images) across a pool of processes, each one with its own copy of a Model.
+	# The frames reach the workers through shared memory slots and the results are returned in submission order.
+
+	def __init__(self, modelClass: type, modelKwargs: dict=None, nWorkers: int=None, maxBatchSize: int=1,
+			  maxFrameBytes: int=1920*1080*3, slotsPerWorker: int=2, startMethod: str=None, threadsPerWorker: int=1, pollInterval: float=1.0):
+		"""
+		Initialization function of the InferenceEngine class.
+
+		Parameters:
+		modelClass (type):		The Model subclass loaded by each worker (e.g. ResNet50 or YOLOv3).
+		modelKwargs (dict):		The parameters given to the constructor of modelClass.
+		nWorkers (int):			The number of worker processes. None means one for each cpu.
+		maxBatchSize (int):		The maximum number of images sent to a worker in a single task (processed with feedBatch).
+		maxFrameBytes (int):	The maximum size (in bytes) of a single image (default: a 1080p BGR frame).
+		slotsPerWorker (int):	How many tasks can be queued for each worker (more slots keep the workers busy, but use more memory).
+		startMethod (str):		The multiprocessing start method ("fork", "spawn", "forkserver"). None means the platform default.
+		threadsPerWorker (int):	The threads of OpenCV in each worker (cv2.setNumThreads). None keeps the OpenCV default (one for each cpu).
+		pollInterval (float):	The seconds between the checks that the workers are still alive while waiting for a result.
+		"""
+		self.modelClass = modelClass
+		self.modelKwargs = {} if modelKwargs is None else modelKwargs
+		self.nWorkers = mp.cpu_count() if nWorkers is None else nWorkers
+		self.maxBatchSize = maxBatchSize
+		self.slotBytes = maxBatchSize * self._align(maxFrameBytes)
+		self.threadsPerWorker = threadsPerWorker
+		self.pollInterval = pollInterval
+
+		ctx = mp.get_context(startMethod)
+		self._slots = [ shared_memory.SharedMemory(create=True, size=self.slotBytes) for _ in range(self.nWorkers*slotsPerWorker) ]
+		self._freeSlots = list(range(len(self._slots)))
+		self._taskQueue = ctx.Queue()
+		self._resultQueue = ctx.Queue()
+		self._nextTaskId = 0
+		self._pending = {}			#taskId -> slot index used by the task
+		self._done = {}				#taskId -> result of the task, or the exception raised by it (completed but not yet retrieved)
+		self._workerStats = [ {"tasks": 0, "images": 0, "busyTime": 0.0} for _ in range(self.nWorkers) ]
+
+		slotNames = [ slot.name for slot in self._slots ]
+		self._workers = [ ctx.Process(target=_worker, args=(i, modelClass, self.modelKwargs, slotNames, self._taskQueue, self._resultQueue, threadsPerWorker),
+									 daemon=True)
+						 for i in range(self.nWorkers) ]
+		for p in self._workers:
+			p.start()
+
+	### Public functions
+	def submit(self, images: "list of images", confidence: float=0.5) -> int:
+		""" Copy the images (at most maxBatchSize) in a free shared memory slot, queue them for a worker and return the id of the task. """
+		if len(images)==0 or len(images)>self.maxBatchSize:
+			raise ValueError("A task must have between 1 and {} images (got {})".format(self.maxBatchSize, len(images)))
+		while len(self._freeSlots)==0:
+			self._collect()		#wait for a worker to release a slot
+
+		slotIndex = self._freeSlots.pop()
+		metas = self._pack(slotIndex, images)
+		taskId = self._nextTaskId
+		self._nextTaskId += 1
+		self._pending[taskId] = slotIndex
+		self._taskQueue.put((taskId, slotIndex, metas, confidence))
+		return taskId
+
+	def result(self, taskId: int) -> list:
+		""" 
+			Wait (if needed) and return the list of outputs (one for each image) of the given task.
+			If the task failed in the worker the error is raised here (as a RuntimeError with the traceback of the worker).
+		"""
+		while taskId not in self._done:
+			if taskId not in self._pending:
+				raise KeyError("Unknown (or already retrieved) task: {}".format(taskId))
+			self._collect()
+		out = self._done.pop(taskId)
+		if isinstance(out, Exception):
+			raise out
+		return out
+
+	def map(self, images: "list of images", confidence: float=0.5, batchSize: int=None) -> list:
+		""" Process all the images (in batches of batchSize, default maxBatchSize) and return their outputs in the same order. """
+		batchSize = self.maxBatchSize if batchSize is None else min(batchSize, self.maxBatchSize)
+		taskIds = []
+		results = []
+		for start in range(0, len(images), batchSize):
+			taskIds.append(self.submit(images[start : start+batchSize], confidence))
+			#retrieve the completed results while submitting, to keep the memory bounded
+			while len(taskIds)>0 and taskIds[0] in self._done:
+				results.extend(self.result(taskIds.pop(0)))
+
+		for taskId in taskIds:
+			results.extend(self.result(taskId))
+		return results
+
+	def stats(self) -> "list of dict":
+		""" Return, for each worker, the number of tasks and images processed, the busy time (seconds) and the throughput (images/s). """
+		return [ dict(s, imagesPerSec=s["images"]/s["busyTime"] if s["busyTime"]>0 else 0.0) for s in self._workerStats ]
+
+	def release(self) -> None:
+		""" Stop the workers and free the shared memory. """
+		for _ in self._workers:
+			self._taskQueue.put(None)
+		for p in self._workers:
+			p.join()
+		for slot in self._slots:
+			slot.close()
+			slot.unlink()
+		self._slots = []
+
+	### Private functions
+	def _align(self, nBytes: int, alignment: int=64) -> int:
+		return (nBytes + alignment-1) // alignment * alignment
+
+	def _pack(self, slotIndex: int, images: "list of images") -> "list of tuple":
+		""" Copy the images one after the other inside the slot, return their (offset, shape, dtype) descriptions. """
+		buf = self._slots[slotIndex].buf
+		metas = []
+		offset = 0
+		for image in images:
+			image = np.ascontiguousarray(image)
+			if offset + image.nbytes > self.slotBytes:
+				self._freeSlots.append(slotIndex)
+				raise ValueError("The images are too big for a slot of {} bytes (increase maxFrameBytes)".format(self.slotBytes))
+			np.ndarray(image.shape, dtype=image.dtype, buffer=buf, offset=offset)[...] = image
+			metas.append((offset, image.shape, image.dtype.str))
+			offset += self._align(image.nbytes)
+		return metas
+
+	def _collect(self) -> None:
+		""" Wait for a single result from the workers and free its slot (raise a RuntimeError if a worker died). """
+		while True:
+			try:
+				(taskId, workerId, out, elapsed, error) = self._resultQueue.get(timeout=self.pollInterval)
+				break
+			except queue.Empty:
+				dead = [ (i, p.exitcode) for (i, p) in enumerate(self._workers) if not p.is_alive() ]
+				if len(dead)>0:
+					raise RuntimeError("Worker {} died (exit code {}): its tasks are lost".format(*dead[0]))
+		if taskId is None:
+			raise RuntimeError("Worker {} failed to load the model:\n{}".format(workerId, error))
+
+		self._freeSlots.append(self._pending.pop(taskId))
+		if error is not None:
+			#kept as the result of the task: it is raised by result (the other tasks are not affected)
+			self._done[taskId] = RuntimeError("Worker {} failed on task {}:\n{}".format(workerId, taskId, error))
+			return
+
+		stats = self._workerStats[workerId]
+		stats["tasks"] += 1
+		stats["images"] += len(out)
+		stats["busyTime"] += elapsed
+		self._done[taskId] = out
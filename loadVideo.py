@@ -1,14 +1,18 @@
 # import the necessary packages
 from imutils.video import VideoStream, FileVideoStream, FPS
 #imutils: https://github.com/jrosebr1/imutils/tree/master/imutils/video
+from threading import Thread, Lock, Condition
 import datetime
 import time
+import cv2
 import os
 
+from metrics import metrics
+
 class LoadVideo:
 	# The class process a video file or the webcam to return a frame when requested.
 
-	def __init__(self, source: str="0", warmUp: float=1.0, simulateRealtime: int=0):
+	def __init__(self, source: str="0", warmUp: float=1.0, simulateRealtime: int=0, realtimeMode: str=None, seekThreshold: int=30):
 		""" 
 		Initialization function of the LoadVideo class.
   
@@ -17,14 +21,51 @@ class LoadVideo:
 		warmUp (float):		The number of seconds for warm up the webcam.
 		simulateRealtime(int):	If the flag is 0 the frame of the video are all used, if it is greater (fps of the input video) some frames are discarded in order to simultate a real-time processing. This flag influence only file video processing. (i.e. if 0.5 seconds pass from a request to the next one so some frames can be discarded because are already "passed" and "no more available")
 		  NB: this method only speedup the processing by burn some frames, if the processing is faster than the original fps of the video nothing is done.
+		realtimeMode (str):	Optional real-time mode, the frames are read with a cv2.VideoCapture (not with the imutils streams):
+		  - "skip":		(video files) discard the frames already "passed" according to the wall clock since the first read (like simulateRealtime, with the fps of the source).
+		  - "adaptive":	(video files) discard, at each read, the frames that the source produces during the measured processing time of a frame.
+		  - "latest":	(live sources, e.g. webcam or rtsp url) a thread keeps reading the frames and read return only the latest one.
+		  In the other modes the discarded frames are grabbed without being decoded (retrieve) or, if more than seekThreshold, skipped with a seek.
+		seekThreshold (int):	The minimum number of frames to discard that are skipped with a seek instead of grabbing them.
 		"""
 		if source=="-1" or None:
 			source="0"
+		if realtimeMode not in (None, "skip", "adaptive", "latest"):
+			raise ValueError("Unknown realtimeMode: {} (use 'skip', 'adaptive' or 'latest')".format(realtimeMode))
 
 		self.source = source
 		self._fps = None
+		self.startTime = None
+		self.realtimeMode = realtimeMode
+		self.seekThreshold = seekThreshold
+		self.counters = { "decoded": 0, "skipped": 0, "delivered": 0 }
+		self._skippedReported = 0			#the skipped frames already added to the metrics
+		self.stream = None
+		self.capture = None
 		
-		if source.isdigit(): #loading stream form webcam
+		if realtimeMode is not None:	#loading with a cv2.VideoCapture (frames can be skipped without decoding)
+			self.realtime = source.isdigit()
+			self.capture = cv2.VideoCapture(int(source) if source.isdigit() else source)
+			if not self.capture.isOpened():
+				print("Warning cannot open source:", source)
+			self.sourceFps = self.capture.get(cv2.CAP_PROP_FPS) or 30.0		#some webcams return 0
+			self.position = 0					#the index of the next frame of the source
+			self._processingTime = None			#moving average of the seconds between 2 reads ("adaptive" mode)
+			self._lastRead = None
+			if realtimeMode=="latest":
+				self._lock = Lock()
+				self._newFrame = Condition(self._lock)	#notified (under the lock) when a frame is read or the source ends
+				self._grabbed = 0				#frames read and not yet delivered
+				self._latest = None				#the last frame read by the thread (swapped under the lock)
+				self._stopped = False
+				self._releaseRequested = False	#release gave up waiting: the thread releases the capture when it ends
+				self._finished = False
+				self._thread = Thread(target=self._grabLoop, daemon=True)
+				self._thread.start()
+			if self.realtime:
+				time.sleep(warmUp)	#warm up the camera
+
+		elif source.isdigit(): #loading stream form webcam
 			self.realtime = True
 			self.stream = VideoStream(src=int(source)).start()
 			time.sleep(warmUp)	#warm up the camera
@@ -37,15 +78,23 @@ class LoadVideo:
 				print("Warning missing source file:", source)
 
 		#make simulateRealtime 0 even according to the type of source video
-		self.simulateRealtime = 0 if self.realtime or simulateRealtime==0 else simulateRealtime
+		self.simulateRealtime = 0 if self.realtime or simulateRealtime==0 or realtimeMode is not None else simulateRealtime
 		if self.simulateRealtime!=0:
 			#set some parameters for the realtime simulation
 			self.millisecPerFrame = 1000/self.simulateRealtime	#how many millisec each frame took
 			self.totalframesDiscarded = 0						#total number of frames discarded and not processed
 			self.startTime = None								#time of start processing time
 
-	def read(self) -> "numpy.ndarray":
-		""" Return a new frame of the stream. """
+	def read(self, out: "numpy.ndarray"=None) -> "numpy.ndarray":
+		""" 
+		Return a new frame of the stream.
+
+		Parameters:
+		out (numpy.ndarray):	Optional preallocated frame of the shape of the source frames. It is used only by the "skip" and
+		  "adaptive" modes, that decode the frame directly into it (no allocation). The other modes already return a new frame
+		  decoded by their thread, so out is ignored (never copied into): always use the returned frame.
+		"""
+		start = metrics.start()
 		if self._fps is None:
 			# initialize the FPS counter
 			self._fpsStart()
@@ -53,6 +102,11 @@ class LoadVideo:
 			# update the FPS counter
 			self._fps.update()
 
+		if self.realtimeMode=="latest":
+			return self._deliver(self._readLatest(), start)
+		if self.realtimeMode is not None:
+			return self._deliver(self._readSkipping(out), start)
+
 		#get the new frame
 		if self.startTime is None:
 			self.startTime = datetime.datetime.now()
@@ -73,11 +127,108 @@ class LoadVideo:
 				#self._fps.update()			#delete this row to measure the real fps...
 
 				discard = self.stream.read()#burn already gone frames
+				self.counters["decoded"] += 1
+				self.counters["skipped"] += 1
 				if discard is None:
 					return None				#corner case: reach the end of the file video
 				
 		# get the frame that will be retrieved
-		return self.stream.read()
+		frame = self.stream.read()
+		self.counters["decoded"] += 1
+		return self._deliver(frame, start)
+
+	### Real-time modes
+	def _deliver(self, frame: "numpy.ndarray", start: float=None) -> "numpy.ndarray":
+		if frame is not None:
+			self.counters["delivered"] += 1
+		if start is not None:
+			metrics.stop("decode", start)
+			metrics.inc("loadVideo.skipped", self.counters["skipped"] - self._skippedReported)
+			self._skippedReported = self.counters["skipped"]
+		return frame
+
+	def _readSkipping(self, out: "numpy.ndarray"=None) -> "numpy.ndarray":
+		""" Read the next frame from the capture, discarding the frames that are already "passed" ("skip" and "adaptive" modes). """
+		now = time.perf_counter()
+		toSkip = 0
+		if self.realtimeMode=="skip":
+			#the frame that the source is showing now, according to the time passed from the first read
+			if self.startTime is None:
+				self.startTime = now
+			toSkip = int((now-self.startTime)*self.sourceFps) - self.position
+
+		elif self._lastRead is not None:	#"adaptive"
+			#the frames produced by the source while the last frame was processed (exponential moving average of the processing time)
+			elapsed = now-self._lastRead
+			self._processingTime = elapsed if self._processingTime is None else 0.8*self._processingTime + 0.2*elapsed
+			toSkip = int(round(self._processingTime*self.sourceFps)) - 1
+		self._lastRead = now
+
+		if toSkip>0 and not self._skip(toSkip):
+			return None		#corner case: reach the end of the file video
+
+		(grabbed, frame) = self.capture.read(out)
+		if not grabbed:
+			return None
+		self.position += 1
+		self.counters["decoded"] += 1
+		return frame
+
+	def _skip(self, n: int) -> bool:
+		""" Discard n frames without decoding them, return False if the end of the video is reached. """
+		if n>=self.seekThreshold and not self.realtime:
+			total = self.capture.get(cv2.CAP_PROP_FRAME_COUNT)
+			if total>0 and self.position+n >= total:
+				return False
+			if self.capture.set(cv2.CAP_PROP_POS_FRAMES, self.position+n):
+				self.position += n
+				self.counters["skipped"] += n
+				return True
+
+		for _ in range(n):
+			if not self.capture.grab():		#grab without retrieve: the frame is not decoded
+				return False
+			self.position += 1
+			self.counters["skipped"] += 1
+		return True
+
+	def _grabLoop(self) -> None:
+		""" 
+			The thread of the "latest" mode: keep reading the frames of the source. The (slow) read is done without the lock,
+			that is taken only to swap the new frame with the latest one, so read never waits for the source.
+		"""
+		frame = None		#the buffer of the next read (the previous latest frame, if read did not take it)
+		while not self._stopped:
+			(grabbed, frame) = self.capture.read(frame)
+			if not grabbed:
+				break
+			with self._lock:
+				(self._latest, frame) = (frame, self._latest)
+				self._grabbed += 1
+				self.counters["decoded"] += 1
+				self._newFrame.notify_all()
+		with self._lock:
+			self._stopped = True
+			self._finished = True
+			self._newFrame.notify_all()	#wake up a waiting read
+			releaseRequested = self._releaseRequested
+		if releaseRequested:
+			self.capture.release()
+
+	def _readLatest(self) -> "numpy.ndarray":
+		""" Return only the latest frame read by the thread ("latest" mode), None if the source is ended. """
+		with self._lock:
+			self._newFrame.wait_for(lambda: self._grabbed>0 or self._finished)
+			if self._grabbed==0:
+				return None		#the source is ended (or closed) and there is no new frame
+			(frame, self._latest) = (self._latest, None)	#taken (no copy): the thread reads the next frame into a new buffer
+			self.counters["skipped"] += self._grabbed-1
+			self._grabbed = 0
+		return frame
+
+	def stats(self) -> dict:
+		""" Return the counters of the frames: decoded, skipped (never decoded, or decoded only to be discarded) and delivered. """
+		return dict(self.counters)
 
 	def _fpsStart(self) -> None:
 		""" Start the FramePerSecond calculator. """
@@ -104,15 +255,36 @@ class LoadVideo:
 		""" Return the original fps rate of the source video/webcam. """
 		# To capture the fps rate of a video file the command should be: double fps = openedvideo.get(CV_CAP_PROP_FPS)
 		# as stated here: https://answers.opencv.org/question/3294/get-video-fps-with-videocapture/
-		#if self.realtime:
-		#	print("todo: get fps of webcam")
-		#else:
-		#	return openedvideo.get(CV_CAP_PROP_FPS)
-		print("todo: function not implemented yet.")
-
-	def release(self) -> None:
-		""" Release the all the resources used. """
-		self.stream.stop()
+		if self.capture is not None:
+			return self.sourceFps
+		#the imutils streams wrap a cv2.VideoCapture (the webcam one inside a second level)
+		capture = getattr(self.stream, "stream", None)
+		capture = getattr(capture, "stream", capture)
+		if capture is not None and hasattr(capture, "get"):
+			return capture.get(cv2.CAP_PROP_FPS)
+		print("Warning: fps of the source not available.")
+		return 0.0
+
+	def release(self, timeout: float=2.0) -> None:
+		""" 
+		Release the all the resources used.
+
+		Parameters:
+		timeout (float):	The seconds to wait for the thread of the "latest" mode. If it is still blocked in a read (e.g. a stalled
+		  network source) the capture is released by the thread itself when the read returns.
+		"""
+		if self.capture is not None:
+			if self.realtimeMode=="latest":
+				self._stopped = True
+				self._thread.join(timeout)
+				with self._lock:
+					self._releaseRequested = not self._finished
+				if self._releaseRequested:
+					print("Warning: the reading thread did not stop in {} seconds (the capture is released when it does)".format(timeout))
+					return
+			self.capture.release()
+		else:
+			self.stream.stop()
 
 
 #from storeVideo import StoreVideo
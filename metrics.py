@@ -0,0 +1,182 @@
+# import the necessary packages
+from threading import Thread, Lock, Event
+from bisect import bisect_left
+import json
+import time
+import os
+
+# The upper bounds (seconds) of the latency buckets: from 10us to 10s, 4 buckets for each power of 10
+BUCKETS = tuple( round(m * 10**e, 9) for e in range(-5, 1) for m in (1, 2.5, 5, 7.5) ) + (10.0,)
+
+class Histogram:
+	# A latency histogram with fixed buckets (as the Prometheus ones): recording a value costs a bisect and a few sums.
+
+	def __init__(self, bounds: tuple=BUCKETS):
+		self.bounds = bounds
+		self.counts = [0] * (len(bounds)+1)		#the last one is for the values greater than the last bound
+		self.count = 0
+		self.sum = 0.0
+		self.max = 0.0
+
+	def observe(self, value: float) -> None:
+		self.counts[bisect_left(self.bounds, value)] += 1
+		self.count += 1
+		self.sum += value
+		if value > self.max:
+			self.max = value
+
+	def quantile(self, q: float) -> float:
+		""" Return the upper bound of the bucket that contains the q quantile (0..1), the max for the last bucket. """
+		if self.count==0:
+			return 0.0
+		rank = q * self.count
+		total = 0
+		for (i, n) in enumerate(self.counts):
+			total += n
+			if total >= rank and n>0:
+				return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+		return self.max
+
+	def summary(self) -> dict:
+		return { "count": self.count, "sum": self.sum, "mean": self.sum/self.count if self.count>0 else 0.0, "max": self.max,
+				 "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99) }
+
+
+class Metrics:
+	# The class collect the latency of the stages of the hot path (decode, blob, forward, postprocess, nms, write), the counters
+	# (e.g. dropped frames) and the gauges (e.g. queue depths) of LoadVideo, Model, StoreVideo and Pipeline.
+	# The module instance `metrics` is the one used by all of them: it is disabled by default, and then each probe is a single
+	# check of the enabled flag. The values can be read with snapshot() or dumped periodically to a file (JSON or Prometheus text).
+
+	def __init__(self, enabled: bool=False, prefix: str="opencvpyutils"):
+		"""
+		Initialization function of the Metrics class.
+
+		Parameters:
+		enabled (bool):		If to record the values (see enable/disable).
+		prefix (str):		The prefix of the names of the Prometheus metrics.
+		"""
+		self.enabled = enabled
+		self.prefix = prefix
+		self._lock = Lock()
+		self._histograms = {}
+		self._counters = {}
+		self._gauges = {}
+		self._dumpThread = None
+		self._dumpStop = Event()
+		self._startTime = time.time()
+
+	### Public functions
+	def enable(self) -> None:
+		self.enabled = True
+
+	def disable(self) -> None:
+		self.enabled = False
+
+	def start(self) -> float:
+		""" Return the start time of a stage to pass to stop (None when disabled). """
+		return time.perf_counter() if self.enabled else None
+
+	def stop(self, stage: str, start: float) -> None:
+		""" Record the seconds passed from start (see start) in the histogram of the stage. """
+		if start is not None:
+			self.observe(stage, time.perf_counter() - start)
+
+	def observe(self, stage: str, seconds: float) -> None:
+		""" Record a latency (seconds) in the histogram of the stage. """
+		if not self.enabled:
+			return
+		with self._lock:
+			histogram = self._histograms.get(stage)
+			if histogram is None:
+				histogram = self._histograms[stage] = Histogram()
+			histogram.observe(seconds)
+
+	def inc(self, name: str, n: int=1) -> None:
+		""" Add n to the counter (e.g. the dropped frames). """
+		if not self.enabled:
+			return
+		with self._lock:
+			self._counters[name] = self._counters.get(name, 0) + n
+
+	def gauge(self, name: str, value: float) -> None:
+		""" Set the current value of the gauge (e.g. the depth of a queue). """
+		if not self.enabled:
+			return
+		self._gauges[name] = value
+
+	def snapshot(self) -> dict:
+		""" Return the summary of each histogram (count, sum, mean, max, p50, p90, p99 in seconds), the counters and the gauges. """
+		with self._lock:
+			return { "time": time.time(), "uptime": time.time() - self._startTime,
+					 "stages": { name: h.summary() for (name, h) in self._histograms.items() },
+					 "counters": dict(self._counters), "gauges": dict(self._gauges) }
+
+	def toJson(self) -> str:
+		return json.dumps(self.snapshot(), indent=1)
+
+	def toPrometheus(self) -> str:
+		""" Return all the values in the Prometheus text format (the stages as a single histogram with the label stage). """
+		name = self.prefix + "_stage_seconds"
+		lines = [ "# TYPE {} histogram".format(name) ]
+		with self._lock:
+			for (stage, h) in sorted(self._histograms.items()):
+				total = 0
+				for (bound, n) in zip(h.bounds + (float("inf"),), h.counts):
+					total += n
+					le = "+Inf" if bound==float("inf") else repr(bound)
+					lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(name, stage, le, total))
+				lines.append('{}_sum{{stage="{}"}} {}'.format(name, stage, repr(h.sum)))
+				lines.append('{}_count{{stage="{}"}} {}'.format(name, stage, h.count))
+			for (counter, n) in sorted(self._counters.items()):
+				lines += [ "# TYPE {}_{}_total counter".format(self.prefix, _safe(counter)), "{}_{}_total {}".format(self.prefix, _safe(counter), n) ]
+			for (gauge, v) in sorted(self._gauges.items()):
+				lines += [ "# TYPE {}_{} gauge".format(self.prefix, _safe(gauge)), "{}_{} {}".format(self.prefix, _safe(gauge), v) ]
+		return "\n".join(lines) + "\n"
+
+	def dump(self, path: str, format: str="json") -> None:
+		""" Write the values to the file ("json" or "prometheus" format), atomically (a reader never sees a partial file). """
+		if format not in ("json", "prometheus"):
+			raise ValueError("Unknown format: {} (use 'json' or 'prometheus')".format(format))
+		text = self.toJson() if format=="json" else self.toPrometheus()
+		tmp = path + ".tmp"
+		with open(tmp, "w") as f:
+			f.write(text)
+		os.replace(tmp, path)
+
+	def startDump(self, path: str, interval: float=10.0, format: str="json") -> None:
+		""" Dump the values to the file every interval seconds, with a background thread (see stopDump). """
+		self.stopDump()
+		self._dumpStop.clear()
+		self._dumpThread = Thread(target=self._dumpLoop, args=(path, interval, format), daemon=True)
+		self._dumpThread.start()
+
+	def stopDump(self) -> None:
+		""" Stop the periodic dump (the file is written a last time). """
+		if self._dumpThread is not None:
+			self._dumpStop.set()
+			self._dumpThread.join()
+			self._dumpThread = None
+
+	def reset(self) -> None:
+		""" Forget all the recorded values. """
+		with self._lock:
+			self._histograms.clear()
+			self._counters.clear()
+			self._gauges.clear()
+			self._startTime = time.time()
+
+	### Private functions
+	def _dumpLoop(self, path: str, interval: float, format: str) -> None:
+		while not self._dumpStop.wait(interval):
+			self.dump(path, format)
+		self.dump(path, format)
+
+
+def _safe(name: str) -> str:
+	""" Return the name usable in a Prometheus metric name (only letters, digits and underscores). """
+	return "".join( c if c.isalnum() else "_" for c in name )
+
+
+# The instance shared by LoadVideo, Model, StoreVideo and Pipeline
+metrics = Metrics()
@@ -1,8 +1,117 @@
 # import the necessary packages
 from abc import ABC # ABC = Abstract Method Class
+from threading import Lock
 import numpy as np
+import time
 import cv2
 
+from metrics import metrics
+
+# the detections as a numpy structured array: one element for each detection (same info of [label, confidence, [x, y, w, h]])
+DETECTION_DTYPE = np.dtype([("classId", np.int32), ("confidence", np.float32), ("x", np.int32), ("y", np.int32), ("w", np.int32), ("h", np.int32)])
+
+################################################################################################################
+############################     Network Registry         ######################################################
+################################################################################################################
+# The networks loaded in this process: each (framework, paths) is parsed once and shared by all the models that use it.
+_readers = {
+	"darknet": lambda path, path2: cv2.dnn.readNetFromDarknet(path, path2),
+	"caffe":   lambda path, path2: cv2.dnn.readNetFromCaffe(path, path2),
+	"onnx":    lambda path, path2: cv2.dnn.readNetFromONNX(path),
+}
+_netRegistry = {}		#key -> cv2.dnn.Net
+_netLoadTimes = {}		#key -> seconds spent to load the network
+_netLock = Lock()		#protects the dicts (it is never held while a network is read)
+_keyLocks = {}			#key -> Lock held while the shared network of the key is read (only the loads of the same files wait)
+
+# The backend/target couples of opencv DNN, by name (the names of the constants: the ones missing in this opencv build are unavailable)
+BACKENDS = {
+	"default":			("DNN_BACKEND_DEFAULT",	"DNN_TARGET_CPU"),
+	"opencv":			("DNN_BACKEND_OPENCV",	"DNN_TARGET_CPU"),
+	"opencvFP16":		("DNN_BACKEND_OPENCV",	"DNN_TARGET_CPU_FP16"),
+	"inferenceEngine":	("DNN_BACKEND_INFERENCE_ENGINE", "DNN_TARGET_CPU"),
+	"opencl":			("DNN_BACKEND_OPENCV",	"DNN_TARGET_OPENCL"),
+	"openclFP16":		("DNN_BACKEND_OPENCV",	"DNN_TARGET_OPENCL_FP16"),
+	"cuda":				("DNN_BACKEND_CUDA",	"DNN_TARGET_CUDA"),
+	"cudaFP16":			("DNN_BACKEND_CUDA",	"DNN_TARGET_CUDA_FP16"),
+}
+
+def availableBackends() -> list:
+	""" Return the names of the BACKENDS supported by the installed opencv (in the order of BACKENDS). """
+	available = []
+	for (name, (backend, target)) in BACKENDS.items():
+		(backend, target) = (getattr(cv2.dnn, backend, None), getattr(cv2.dnn, target, None))
+		if backend is None or target is None:
+			continue
+		if hasattr(cv2.dnn, "getAvailableTargets"):
+			if target in cv2.dnn.getAvailableTargets(backend):
+				available.append(name)
+		elif name in ("default", "opencv"):
+			available.append(name)
+	return available
+
+def applyBackend(net: "cv2.dnn.net", backend: str="default") -> None:
+	""" Set the preferable backend and target of the network, with the name of one of the BACKENDS. """
+	if backend not in BACKENDS:
+		raise ValueError("Unknown backend: {} (use one of {})".format(backend, list(BACKENDS)))
+	(b, t) = BACKENDS[backend]
+	if not hasattr(cv2.dnn, b) or not hasattr(cv2.dnn, t):
+		raise ValueError("Backend not supported by this opencv build: {}".format(backend))
+	net.setPreferableBackend(getattr(cv2.dnn, b))
+	net.setPreferableTarget(getattr(cv2.dnn, t))
+
+def loadNet(framework: str, modelPath: str, modelPath2: str=None, shared: bool=True, backend: str="default") -> "cv2.dnn.net":
+	"""
+		Return the network of the given files, reading them only the first time (if shared is True).
+		NB: a shared network has a single input/output state, so the models that share it must not feed it from many threads at once.
+
+		Parameters:
+		framework (str):	The format of the model: "darknet", "caffe" or "onnx".
+		modelPath (str):	The path to the model (the .cfg, .prototxt or .onnx file).
+		modelPath2 (str):	The path to the second part of the model (the weights), if any.
+		shared (bool):		If to take the network from (and put it in) the registry, otherwise a private copy is loaded.
+		backend (str):		The name of one of the BACKENDS: the same files with different backends are different networks.
+	"""
+	if framework not in _readers:
+		raise ValueError("Unknown framework: {} (use one of {})".format(framework, list(_readers)))
+	key = (framework, modelPath, modelPath2, backend)
+	if not shared:
+		return _readNet(key)
+
+	with _netLock:
+		if key in _netRegistry:
+			return _netRegistry[key]
+		keyLock = _keyLocks.setdefault(key, Lock())
+	#two models asking for the same files wait for a single read, the other loads go on in parallel
+	with keyLock:
+		with _netLock:
+			if key in _netRegistry:
+				return _netRegistry[key]
+		net = _readNet(key)
+		with _netLock:
+			_netRegistry[key] = net
+		return net
+
+def _readNet(key: tuple) -> "cv2.dnn.net":
+	""" Read the network of the key (framework, modelPath, modelPath2, backend) from its files, recording the load time. """
+	(framework, modelPath, modelPath2, backend) = key
+	start = time.perf_counter()
+	net = _readers[framework](modelPath, modelPath2)
+	applyBackend(net, backend)
+	with _netLock:
+		_netLoadTimes[key] = time.perf_counter() - start
+	return net
+
+def netLoadTimes() -> dict:
+	""" Return the seconds spent to load each network: {(framework, modelPath, modelPath2, backend): seconds}. """
+	with _netLock:
+		return dict(_netLoadTimes)
+
+def clearNetRegistry() -> None:
+	""" Forget the shared networks (the models already created keep their own reference). """
+	with _netLock:
+		_netRegistry.clear()
+
 ################################################################################################################
 ############################     Model Super Class        ######################################################
 ################################################################################################################
@@ -10,29 +119,202 @@ class Model(ABC):
 	### Variables
 	modelPath:  str=None		#path to the model
 	modelPath2: str=None		#path to the second part of the model
-	net: "cv2.dnn.net"=None		#the opencv network model
+	_net: "cv2.dnn.net"=None	#the opencv network model (see the net property)
+	_netSource: tuple=None		#the (framework, modelPath, modelPath2, shared) of a network of the registry (see loadNetwork)
+	backend: str="default"		#the name of the backend/target of the network (see setBackend)
 	# objDetection
 	namesPath:  str=None		#path to the file where the names of detection are saved
 	names:  list=None			#the list of names of detection
 	# imgClassification
 	layer: str=None				#the name of the layer where to end the DNN
+	# batch processing
+	maxBatchSize: int=32		#the maximum number of images processed by a single forward pass (see feedBatch)
+	# blob parameters (the same of cv2.dnn.blobFromImage, with crop=False)
+	blobSize: tuple=None		#the (width, height) of the network input
+	blobScale: float=1.0		#the scalefactor
+	blobMean: tuple=(0, 0, 0)	#the mean subtracted from each channel (after the swap)
+	blobSwapRB: bool=False		#if to swap the red and blue channels
 
 	### Set Functions
 	def __init__():
 		pass
 
+	@property
+	def net(self) -> "cv2.dnn.net":
+		""" The opencv network model: in lazy mode it is loaded at the first use (e.g. the first feed). """
+		if self._net is None and self._netSource is not None:
+			self._net = loadNet(*self._netSource, backend=self.backend)
+		return self._net
+
+	@net.setter
+	def net(self, net: "cv2.dnn.net") -> None:
+		self._net = net
+		self._netSource = None
+
 	def setNetwork(self, net: "cv2.dnn.net") -> None:
 		""" Set the network given. """
 		self.net = net
 
+	def loadNetwork(self, framework: str, modelPath: str, modelPath2: str=None, lazy: bool=False, shared: bool=False) -> None:
+		""" 
+			Set the network of the given files (see loadNet). With lazy=True the files are read at the first use of the network, 
+			so creating the model is immediate.
+			With shared=True the network is taken from the process registry: the same files are parsed only once, but all the 
+			models with the same files and backend use the same network, so they must not be fed from different threads 
+			(setInput and forward state belong to the network). By default each model has its own network.
+		"""
+		self._net = None
+		self._netSource = (framework, modelPath, modelPath2, shared)
+		if not lazy:
+			self.net
+
+	def setBackend(self, backend: str="default", nThreads: int=None) -> None:
+		""" 
+			Set the backend/target of the network with the name of one of the BACKENDS (see availableBackends).
+			A shared network (see loadNetwork) is taken from the registry (or loaded) again with the new backend, so the other 
+			models that share it are not changed. A private network is changed in place.
+			nThreads, if given, is the number of threads used by opencv (cv2.setNumThreads): it is a setting of the whole process.
+		"""
+		if backend not in BACKENDS:
+			raise ValueError("Unknown backend: {} (use one of {})".format(backend, list(BACKENDS)))
+		if nThreads is not None:
+			cv2.setNumThreads(int(nThreads))
+		if backend==self.backend:
+			return
+		self.backend = backend
+		if self._netSource is not None and self._netSource[3]:
+			if self._net is not None:
+				self._net = None
+				self.net
+		elif self._net is not None:
+			applyBackend(self._net, backend)
+
+	def autoBackend(self, image: "image"=None, backends: "list of str"=None, nThreads: "list of int"=None, repeat: int=5, show: bool=False) -> dict:
+		""" 
+			Try each backend (and number of threads) on the image, keep the fastest one and return the mean seconds of a feed for each of them.
+			The backends not supported by the installed opencv and the configurations that fail (e.g. a target not really supported 
+			by the host) are skipped with a warning.
+
+			Parameters:
+			image (image):		The sample input (None means a random image as big as the network input).
+			backends (list):	The names of the backends to try (None means all the available ones, see availableBackends).
+			nThreads (list):	The numbers of threads to try (None means only the current one).
+			repeat (int):		The number of timed feeds of each configuration (after one feed of warm up).
+			show (bool):		If to print the time of each configuration.
+		"""
+		if image is None:
+			(w, h) = self.blobSize
+			image = np.random.randint(0, 256, (h, w, 3), dtype=np.uint8)
+		available = availableBackends()
+		if backends is None:
+			backends = available
+		skipped = [ b for b in backends if b not in available ]
+		if len(skipped)>0:
+			print("Warning backends not available with this opencv build (skipped): {}".format(skipped))
+			backends = [ b for b in backends if b in available ]
+		if nThreads is None:
+			nThreads = [ cv2.getNumThreads() ]
+
+		times = {}
+		for backend in backends:
+			for threads in nThreads:
+				try:
+					self.setBackend(backend, threads)
+					self.feed(image)		#the first forward pass initialize the backend
+					start = time.perf_counter()
+					for _ in range(repeat):
+						self.feed(image)
+					times[(backend, threads)] = (time.perf_counter() - start) / repeat
+				except (cv2.error, ValueError) as e:
+					print("Warning backend {} with {} threads failed (skipped): {}".format(backend, threads, str(e).strip().split("\n")[-1]))
+					continue
+				if show:
+					print("{:<16} threads: {:<3} -> {:.2f} ms".format(backend, threads, times[(backend, threads)]*1000))
+
+		if len(times)==0:
+			raise ValueError("No backend works on this host")
+		(backend, threads) = min(times, key=times.get)
+		self.setBackend(backend, threads)
+		return times
+
+	def quantize(self, images: "list of images") -> bool:
+		""" 
+			Replace the network with its INT8 version, calibrated on the images (when supported by opencv, see cv2.dnn.Net.quantize).
+			The quantized network is private to the model (it is not shared through the registry). Return if it is done.
+		"""
+		if not hasattr(self.net, "quantize"):
+			print("Warning INT8 quantization is not supported by this opencv build")
+			return False
+		self.net = self.net.quantize([self.blobBatch(images)], cv2.CV_8S, cv2.CV_8S)
+		return True
+
+	def isLoaded(self) -> bool:
+		""" Return True if the network is loaded (False if it is waiting for its first use in lazy mode). """
+		return self._net is not None
+
 	def setLayer(self, layer: str=None) -> None:
 		""" Set the output layer name of the network (if None the last one is chosen). """
 		self.layer = layer
+
+	def setMaxBatchSize(self, maxBatchSize: int) -> None:
+		""" Set the maximum number of images processed by a single forward pass of feedBatch (to bound the memory used). """
+		self.maxBatchSize = max(1, int(maxBatchSize))
 		
 	### Main Flow Functions
 	def blob(self, image) -> "blob":
-		""" Create the blob form the image given. """
-		pass
+		""" Create the blob form the image given (see blobInto). """
+		return self.blobInto([image])
+
+	def blobBatch(self, images: "list of images") -> "blob":
+		""" Create a single NCHW blob (one image for each N) from the list of images given (see blobInto). """
+		return self.blobInto(images)
+
+	def newBlob(self, n: int=1) -> "blob":
+		""" Allocate an (uninitialized) float32 NCHW blob for n images, to be filled with blobInto. """
+		(w, h) = self.blobSize
+		return np.empty((n, 3, h, w), dtype=np.float32)
+
+	def blobInto(self, images: "list of images", out: "blob"=None) -> "blob":
+		""" 
+			Fill the NCHW blob out (default: a new one, see newBlob) with the images, as cv2.dnn.blobFromImages with the blob
+			parameters of the model (crop=False). Return the view of out with the len(images) blobs.
+			The blob is filled by cv2.dnn.blobFromImagesWithParams: writing in an array allocated by numpy is faster than letting
+			opencv allocate it (~3x for a 416x416 blob, see benchmark.benchmarkBlob), so blob and blobBatch (and feed, feedBatch) use it.
+			NB: without blobFromImagesWithParams (opencv < 4.9) the blob is filled with numpy, reusing a resized image buffer:
+			then a model must not fill blobs from many threads at once.
+		"""
+		if out is None:
+			out = self.newBlob(len(images))
+		out = out[:len(images)]
+		if hasattr(cv2.dnn, "blobFromImagesWithParams"):
+			return cv2.dnn.blobFromImagesWithParams(images, out, self._blobParams())
+
+		(w, h) = self.blobSize
+		if getattr(self, "_resized", None) is None or self._resized.shape[:2]!=(h, w):
+			self._resized = np.empty((h, w, 3), dtype=np.uint8)
+
+		#as cv2.dnn.blobFromImage: a scalar mean is subtracted only from the first channel
+		mean = self.blobMean if isinstance(self.blobMean, (tuple, list)) else (self.blobMean, 0, 0)
+		channels = (2, 1, 0) if self.blobSwapRB else (0, 1, 2)
+		for (i, image) in enumerate(images):
+			resized = cv2.resize(image, (w, h), dst=self._resized)
+			for (c, src) in enumerate(channels):
+				np.subtract(resized[:, :, src], mean[c], out=out[i, c], casting="unsafe")
+				if self.blobScale!=1:
+					out[i, c] *= self.blobScale
+		return out
+
+	def _blobParams(self) -> "cv2.dnn.Image2BlobParams":
+		""" Return the parameters of blobFromImagesWithParams equivalent to the blob parameters of the model. """
+		params = cv2.dnn.Image2BlobParams()
+		#as cv2.dnn.blobFromImage: a scalar mean is subtracted only from the first channel
+		mean = tuple(self.blobMean) if isinstance(self.blobMean, (tuple, list)) else (self.blobMean,)
+		params.mean = mean + (0,)*(4-len(mean))
+		params.scalefactor = (self.blobScale,)*4
+		params.size = self.blobSize
+		params.swapRB = self.blobSwapRB
+		params.ddepth = cv2.CV_32F
+		return params
 
 	def setInput(self, blob) -> None:
 		""" Set the input blob for the DNN. """
@@ -60,11 +342,55 @@ class Model(ABC):
 	
 	def feed(self, image, confidence: float=0.5) -> "list or list of list":
 		""" Do in one function: blob, setInput, forward pass and processDnnOutput. """
+		start = metrics.start()
 		blob = self.blob(image)
+		metrics.stop("blob", start)
+
+		start = metrics.start()
 		self.setInput(blob)
 		out = self.forward()
+		metrics.stop("forward", start)
+
+		start = metrics.start()
 		(h, w) = image.shape[:2]
-		return self.processDnnOutput(out, h, w, confidence)
+		result = self.processDnnOutput(out, h, w, confidence)
+		metrics.stop("postprocess", start)
+		return result
+
+	def splitBatchOutput(self, output, n: int) -> list:
+		""" 
+			Split the output of a batched forward pass into n outputs, one for each image of the batch.
+			Each of them has the same layout of the output of a single image forward, so it can be passed to processDnnOutput.
+		"""
+		return [ output[i:i+1] for i in range(n) ]
+
+	def feedBatch(self, images: "list of images", confidence: float=0.5, maxBatchSize: int=None) -> "list":
+		""" 
+			Do the same of feed but for a list of images, returning the list of their processed outputs (in the same order).
+			The images are processed in chunks of (at most) maxBatchSize images, each chunk with a single blob and forward pass.
+			If maxBatchSize is None the value of the model (self.maxBatchSize) is used.
+		"""
+		if maxBatchSize is None:
+			maxBatchSize = self.maxBatchSize
+
+		results = []
+		for start in range(0, len(images), maxBatchSize):
+			chunk = images[start : start+maxBatchSize]
+			tic = metrics.start()
+			blob = self.blobBatch(chunk)
+			metrics.stop("blob", tic)
+
+			tic = metrics.start()
+			self.setInput(blob)
+			outs = self.splitBatchOutput(self.forward(), len(chunk))
+			metrics.stop("forward", tic)
+
+			tic = metrics.start()
+			for (image, out) in zip(chunk, outs):
+				(h, w) = image.shape[:2]
+				results.append(self.processDnnOutput(out, h, w, confidence))
+			metrics.stop("postprocess", tic)
+		return results
 
 	### Utils Functions
 	def getLayerNames(self, show: bool=False) -> "list or list of list":
@@ -79,8 +405,7 @@ class Model(ABC):
 	def useCUDA(self):
 		# set CUDA as the preferable backend and target
 		print("[INFO] setting preferable backend and target to GPU and CUDA...")
-		net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
-		net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
+		self.setBackend("cuda")
 
 ################################################################################################################
 ############################     Object Detection         ######################################################
@@ -88,115 +413,135 @@ class Model(ABC):
 
 #>>>>>>>>>>>>>>>>>>>>>>>>>>>     YOLO v3                  <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<
 class YOLOv3(Model):
+	blobSize = (416, 416)
+	blobScale = 1 / 255.0
+	blobSwapRB = True
+
 	def __init__(self, 
 			  modelPath:  str="../models/yoloV3-coco/yolov3.cfg", 
 			  modelPath2: str="../models/yoloV3-coco/yolov3.weights", 
 			  namesPath:  str="../models/yoloV3-coco/coco.names",
 			  layer:	  list=['yolo_82', 'yolo_94', 'yolo_106'],
-			  useCuda: bool=False):
+			  useCuda: bool=False,
+			  lazy:    bool=False,
+			  backend: str="default",
+			  shared:  bool=False):
 
 		self.modelPath  = modelPath
 		self.modelPath2 = modelPath2
-		self.net = cv2.dnn.readNetFromDarknet(modelPath, modelPath2)
+		self.backend = "cuda" if useCuda else backend
+		self.loadNetwork("darknet", modelPath, modelPath2, lazy=lazy, shared=shared)
 		
 		self.namesPath = namesPath
 		self.names = open(namesPath).read().strip().split("\n")
 		self.layer = layer
-
-		if useCuda:
-			super(YOLOv3, self).useCUDA()
 	
-	def blob(self, image) -> "blob":
-		blob = cv2.dnn.blobFromImage(image, 1 / 255.0, (416, 416), swapRB=True, crop=False)
-		return blob
+	def splitBatchOutput(self, output, n: int) -> list:
+		# with a batch of images each yolo layer has the shape (n, detections, 85), while with a single image it is (detections, 85)
+		if n==1 and output[0].ndim==2:
+			return [output]
+		return [ [ oneLayerOutput[i] for oneLayerOutput in output ] for i in range(n) ]
 
 	def processDnnOutput(self, output, h: int, w: int, confThresh: float=0.5, nmsThresh: float=0.3) -> "list of list":
-		classes = []
-		confidences = []
-		boxes = []
-		
-		# loop over each of the layer outputs (yolo use 3 output layers)
-		for oneLayerOutput in output:
-			# loop over each of the detections
-			for detection in oneLayerOutput:
-
-				# extract the class ID and confidence (i.e., probability) of the current object detection
-				scores = detection[5:]			# a detection has a probability(confidence) for each class (80 for coco)
-				classID = np.argmax(scores)		# extract the class with highest confidence
-				confidence = scores[classID]	# get the highest confidence AKA: np.max(scores)
-
-				# filter out weak predictions by ensuring the detected
-				# probability is greater than the minimum probability
-				if confidence > confThresh:
-					# scale the bounding box coordinates back relative to the size of the image, 
-					# keeping in mind that YOLO actually returns the center (x, y)-coordinates of the bounding box 
-					# followed by the boxes' width and height
-					box = detection[0:4] * np.array([w, h, w, h])
-					(centerX, centerY, width, height) = box.astype("int")
-
-					# use the center (x, y)-coordinates to derive the top and left corner of the bounding box
-					x = int(centerX - (width / 2))
-					y = int(centerY - (height / 2))
-					
-					# update our list of bounding box coordinates, confidences and classes
-					classes.append(self.names[classID])
-					confidences.append(float(confidence))
-					boxes.append([x, y, int(width), int(height)])	#aka: x, y, w, h
+		if len(output)==0:
+			return []
+
+		# stack the outputs of all the layers (yolo use 3 output layers) in a single matrix: one detection for each row
+		detections = np.concatenate([ np.reshape(oneLayerOutput, (-1, oneLayerOutput.shape[-1])) for oneLayerOutput in output ])
+
+		# extract the class ID and confidence (i.e., probability) of all the detections at once
+		scores = detections[:, 5:]										# a detection has a probability(confidence) for each class (80 for coco)
+		classIDs = np.argmax(scores, axis=1)							# extract the class with highest confidence
+		confidences = scores[np.arange(len(scores)), classIDs]			# get the highest confidence AKA: np.max(scores, axis=1)
+
+		# filter out weak predictions by ensuring the detected probability is greater than the minimum probability
+		mask = confidences > confThresh
+		if not mask.any():
+			return []
+		classIDs = classIDs[mask]
+		confidences = confidences[mask]
+
+		# scale the bounding box coordinates back relative to the size of the image, 
+		# keeping in mind that YOLO actually returns the center (x, y)-coordinates of the bounding box 
+		# followed by the boxes' width and height
+		boxes = (detections[mask, 0:4] * np.array([w, h, w, h])).astype("int")
+
+		# use the center (x, y)-coordinates to derive the top and left corner of the bounding box
+		boxes[:, 0] = (boxes[:, 0] - boxes[:, 2] / 2).astype("int")
+		boxes[:, 1] = (boxes[:, 1] - boxes[:, 3] / 2).astype("int")
+
+		# convert back to python types (as expected by NMSBoxes and by the users of the detections)
+		boxes = boxes.tolist()													#aka: x, y, w, h
+		confidences = confidences.astype(float).tolist()
 		
 		#apply non-maxima suppression to suppress weak, overlapping bounding boxes
+		start = metrics.start()
 		idxs = cv2.dnn.NMSBoxes(boxes, confidences, confThresh, nmsThresh)
-		idxs = idxs.flatten()
+		idxs = np.array(idxs).flatten()
+		metrics.stop("nms", start)
 
 		#remove overlapping predictions selected by NMS
-		detections = [ [classes[i], confidences[i], boxes[i]] for i in idxs ]
+		detections = [ [self.names[classIDs[i]], confidences[i], boxes[i]] for i in idxs ]
 		return detections
 	
 
 #>>>>>>>>>>>>>>>>>>>>>>>>>>>     MobileNet SSD            <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<
 class MobileNetSSD(Model):
+	asArray: bool=False		#if to return the detections as a single DETECTION_DTYPE array instead of a list of list
+	blobSize = (300, 300)
+	blobScale = 0.007843
+	blobMean = 127.5
+
 	def __init__(self, 
 			  modelPath:  str="../models/mobileNet_SSD/MobileNetSSD_deploy.prototxt", 
 			  modelPath2: str="../models/mobileNet_SSD/MobileNetSSD_deploy.caffemodel", 
 			  namesPath:  str="../models/mobileNet_SSD/SSDnames.txt",
 			  layer:	  str=None,
-			  useCuda:    bool=False):
+			  useCuda:    bool=False,
+			  asArray:    bool=False,
+			  lazy:       bool=False,
+			  backend:    str="default",
+			  shared:     bool=False):
 
 		self.modelPath  = modelPath
 		self.modelPath2 = modelPath2
-		self.net = cv2.dnn.readNetFromCaffe(self.modelPath, self.modelPath2)
+		self.backend = "cuda" if useCuda else backend
+		self.loadNetwork("caffe", self.modelPath, self.modelPath2, lazy=lazy, shared=shared)
 		
 		self.namesPath = namesPath
 		self.names = open(namesPath).read().strip().split("\n")
 		self.layer = layer
-
-		if useCuda:
-			super(MobileNetSSD, self).useCUDA()
-
-	def blob(self, image) -> "blob":
-		blob = cv2.dnn.blobFromImage(image, 0.007843, (300, 300), 127.5)
-		return blob
-
-	def processDnnOutput(self, output, h: int, w: int, confThresh: float=0.5) -> "list of list":
-		detections = []
-
-		# loop over the detections
-		for i in np.arange(0, output.shape[2]):
-			# extract the confidence (i.e., probability) associated with the prediction
-			confidence = output[0, 0, i, 2]
-
-			# filter out weak detections by ensuring the `confidence` is greater than the minimum confidence
-			if confidence > confThresh:
-				# extract the index of the class label from the `detections`, 
-				# then compute the (x, y)-coordinates of the bounding box for the object
-				idx = int(output[0, 0, i, 1])
-
-				box = output[0, 0, i, 3:7] * np.array([w, h, w, h])
-				(startX, startY, endX, endY) = box.astype("int")
-				box = [startX, startY, endX-startX, endY-startY]	#aka: x, y, w, h
-
-				detections.append([ self.names[idx], confidence, box ])
-
-		return detections
+		self.asArray = asArray
+
+	def splitBatchOutput(self, output, n: int) -> list:
+		# the SSD output is always (1, 1, detections, 7) and the first value of each detection is the index of its image
+		imageIds = output[0, 0, :, 0]
+		return [ output[:, :, imageIds==i, :] for i in range(n) ]
+
+	def processDnnOutput(self, output, h: int, w: int, confThresh: float=0.5, asArray: bool=None) -> "list of list or np.ndarray":
+		""" If asArray (default: the value given to the constructor) the detections are returned as a DETECTION_DTYPE structured array. """
+		if asArray is None:
+			asArray = self.asArray
+
+		# filter out weak detections (all at once) by ensuring the `confidence` is greater than the minimum confidence
+		output = output[0, 0]
+		output = output[output[:, 2] > confThresh]
+
+		# extract the index of the class label from the `detections`, 
+		# then compute the (x, y)-coordinates of the bounding boxes for the objects
+		classIDs = output[:, 1].astype("int")
+		confidences = output[:, 2]
+		boxes = (output[:, 3:7] * np.array([w, h, w, h])).astype("int")
+		boxes[:, 2:4] -= boxes[:, 0:2]		#aka: x, y, w, h (from: startX, startY, endX, endY)
+
+		if asArray:
+			detections = np.empty(len(output), dtype=DETECTION_DTYPE)
+			detections["classId"] = classIDs
+			detections["confidence"] = confidences
+			detections["x"], detections["y"], detections["w"], detections["h"] = boxes.T
+			return detections
+
+		return [ [self.names[idx], confidence, box] for (idx, confidence, box) in zip(classIDs.tolist(), confidences.tolist(), boxes.tolist()) ]
 
 ################################################################################################################
 ############################     Image Classification     ######################################################
@@ -204,43 +549,45 @@ class MobileNetSSD(Model):
 
 #>>>>>>>>>>>>>>>>>>>>>>>>>>>     ResNet50 Model           <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<
 class ResNet50(Model):
+	blobSize = (224, 224)
+	blobMean = (0.485, 0.456, 0.406)
+
 	def __init__(self, 
 			  modelPath: str="../models/resnet50-caffe2/resnet50-caffe2.onnx", 
 			  layer: str="OC2_DUMMY_0",
-			  useCuda: bool=False):
+			  useCuda: bool=False,
+			  lazy: bool=False,
+			  backend: str="default",
+			  shared: bool=False):
 
 		self.modelPath = modelPath
 		self.layer = layer
-		self.net = cv2.dnn.readNetFromONNX(self.modelPath)
-		
-		if useCuda:
-			super(ResNet50, self).useCUDA()
+		self.backend = "cuda" if useCuda else backend
+		self.loadNetwork("onnx", self.modelPath, lazy=lazy, shared=shared)
 			
-	def blob(self, image) -> "blob":
-		return cv2.dnn.blobFromImage(image=image, scalefactor=1, size=(224, 224), mean=(0.485, 0.456, 0.406))
-
 	def processDnnOutput(self, output, _1=None, _2=None, _3=None) -> "list":
 		return output[0].tolist()
 
 
 #>>>>>>>>>>>>>>>>>>>>>>>>>>>     GoogleNet Model          <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<
 class GoogleNet(Model):
+	blobSize = (224, 224)
+	blobMean = (0.485, 0.456, 0.406)
+
 	def __init__(self, 
 			  modelPath:  str="../models/googleNet/bvlc_googlenet.prototxt",
 			  modelPath2: str="../models/googleNet/bvlc_googlenet.caffemodel",
 			  layer: str="pool5/7x7_s1",
-			  useCuda: bool=False):
+			  useCuda: bool=False,
+			  lazy: bool=False,
+			  backend: str="default",
+			  shared: bool=False):
 
 		self.modelPath  = modelPath
 		self.modelPath2 = modelPath2
 		self.layer = layer
-		self.net = cv2.dnn.readNetFromCaffe(self.modelPath, self.modelPath2)
-
-		if useCuda:
-			super(GoogleNet, self).useCUDA()
-
-	def blob(self, image) -> "blob":
-		return cv2.dnn.blobFromImage(image=image, scalefactor=1, size=(224, 224), mean=(0.485, 0.456, 0.406))
+		self.backend = "cuda" if useCuda else backend
+		self.loadNetwork("caffe", self.modelPath, self.modelPath2, lazy=lazy, shared=shared)
 
 	def processDnnOutput(self, output, _1=None, _2=None, _3=None) ->"list":
 		vect = [ [ el[0][0] for el in enc ] for enc in output ]
@@ -0,0 +1,246 @@
+# import the necessary packages
+from threading import Thread, Condition, Timer, current_thread
+from collections import deque
+from queue import Queue
+import time
+import cv2
+
+from metrics import metrics
+
+class _Stream:
+	# The state of a single source of MultiLoadVideo.
+	def __init__(self, source: str):
+		self.source = source
+		self.live = source.isdigit() or "://" in source		#webcam or network stream
+		self.capture = None
+		self.frames = deque()			#buffered (timestamp, frame) couples, the oldest on the left
+		self.last = None				#the last (timestamp, frame) returned by readBatch (repeated by the "timestamp" sync of files)
+		self.bytes = 0					#memory of the buffered frames
+		self.scheduled = False			#if the stream is in the queue of the decoders (or being decoded)
+		self.ended = False
+		self.reconnects = 0
+		self.decoded = 0
+		self.dropped = 0
+
+	def open(self) -> bool:
+		self.capture = cv2.VideoCapture(int(self.source) if self.source.isdigit() else self.source)
+		return self.capture.isOpened()
+
+class MultiLoadVideo:
+	# The class read many sources (video files, webcams, network streams) at the same time with a fixed pool of decoding threads,
+	# and return one frame for each source with readBatch (ready to be processed with a single Model.feedBatch).
+
+	def __init__(self, sources: "list of str", nWorkers: int=4, bufferPerStream: int=2, maxBufferedBytes: int=256*1024*1024,
+			  sync: str="roundRobin", reconnect: bool=True, reconnectDelay: float=2.0, maxReconnects: int=None):
+		"""
+		Initialization function of the MultiLoadVideo class.
+
+		Parameters:
+		sources (list):				The paths of the videos, the numbers of the webcams or the urls of the streams.
+		nWorkers (int):				The number of decoding threads shared by all the sources.
+		bufferPerStream (int):		The maximum number of decoded frames waiting to be read, for each source.
+		maxBufferedBytes (int):		The maximum memory of all the decoded frames waiting to be read (a source without buffered
+									frames can always decode one, so no source is starved by the others).
+		sync (str):					How readBatch choose the frames: "roundRobin" (the oldest buffered frame of each source) or
+									"timestamp": the files are synchronized on their media time (the frame of each file shown at
+									the earliest pending media time: a file that is ahead repeats its last frame, none is dropped),
+									the live sources on the decoding (wall clock) time (the frame nearest to a common time, the
+									older ones are dropped). The two groups have different clocks: they are synchronized separately.
+		reconnect (bool):			If to reopen a live source (webcam or url) that stops working.
+		reconnectDelay (float):		The seconds to wait before a reconnection.
+		maxReconnects (int):		The maximum number of reconnections of each source (None means unlimited).
+		"""
+		if sync not in ("roundRobin", "timestamp"):
+			raise ValueError("Unknown sync: {} (use 'roundRobin' or 'timestamp')".format(sync))
+		self.bufferPerStream = bufferPerStream
+		self.maxBufferedBytes = maxBufferedBytes
+		self.sync = sync
+		self.reconnect = reconnect
+		self.reconnectDelay = reconnectDelay
+		self.maxReconnects = maxReconnects
+		self.timestamps = None				#the times (seconds) of the frames returned by the last readBatch:
+											#the media time for the files, the perf_counter decoding time for the live sources
+
+		self.streams = [ _Stream(str(source)) for source in sources ]
+		self._bytes = 0
+		self._cond = Condition()
+		self._todo = Queue()				#indexes of the streams waiting for a decoder
+		self._stopped = False
+		self._timers = set()				#the pending reconnections
+
+		for (i, stream) in enumerate(self.streams):
+			if not stream.open():
+				print("Warning cannot open source:", stream.source)
+				self._fail(i)
+			else:
+				self._schedule(i)
+		self._workers = [ Thread(target=self._decodeLoop, daemon=True) for _ in range(nWorkers) ]
+		for t in self._workers:
+			t.start()
+
+	### Public functions
+	def readBatch(self, timeout: float=1.0) -> "list of numpy.ndarray":
+		"""
+			Return a list with one frame for each source (in the order of the sources).
+			The frame of a source is None if it is ended, or if it does not produce a frame within the timeout (seconds):
+			so a slow or broken source never blocks the others for more than the timeout.
+			With the "timestamp" sync a file can return the same frame (the same array) in consecutive batches.
+		"""
+		deadline = time.perf_counter() + timeout
+		with self._cond:
+			#wait until each (not ended) stream has a frame, or the timeout
+			while not all( len(s.frames)>0 or s.ended for s in self.streams ):
+				remaining = deadline - time.perf_counter()
+				if remaining<=0:
+					break
+				self._cond.wait(remaining)
+
+			(liveReference, fileReference) = (None, None)
+			if self.sync=="timestamp":
+				#live sources: synchronize on the oldest of the newest frames, no stream goes ahead of the slowest one
+				newest = [ s.frames[-1][0] for s in self.streams if s.live and len(s.frames)>0 ]
+				liveReference = min(newest) if newest else None
+				#files: the earliest media time still to show
+				oldest = [ s.frames[0][0] for s in self.streams if not s.live and len(s.frames)>0 ]
+				fileReference = min(oldest) if oldest else None
+
+			frames = []
+			self.timestamps = []
+			for (i, stream) in enumerate(self.streams):
+				item = self._pop(stream, liveReference) if stream.live else self._popAt(stream, fileReference)
+				frames.append(None if item is None else item[1])
+				self.timestamps.append(None if item is None else item[0])
+				self._schedule(i)
+		return frames
+
+	def more(self) -> bool:
+		""" Return True if at least one source is not ended (or has buffered frames). """
+		with self._cond:
+			return any( not s.ended or len(s.frames)>0 for s in self.streams )
+
+	def stats(self) -> "list of dict":
+		""" Return, for each source: decoded and dropped frames, buffered frames, reconnections and if it is ended. """
+		with self._cond:
+			return [ { "source": s.source, "decoded": s.decoded, "dropped": s.dropped, "buffered": len(s.frames),
+					   "reconnects": s.reconnects, "ended": s.ended } for s in self.streams ]
+
+	def release(self) -> None:
+		""" Stop the decoding threads and release the sources. """
+		with self._cond:
+			self._stopped = True
+			for timer in self._timers:
+				timer.cancel()
+			self._timers.clear()
+		for _ in self._workers:
+			self._todo.put(None)
+		for t in self._workers:
+			t.join()
+		for stream in self.streams:
+			if stream.capture is not None:
+				stream.capture.release()
+
+	### Private functions
+	def _pop(self, stream: _Stream, reference: float) -> tuple:
+		""" Remove and return the chosen buffered (timestamp, frame) of the stream (None if empty). Lock needed. """
+		if len(stream.frames)==0:
+			return None
+		if reference is not None:
+			#drop the frames older than the one nearest to the reference time
+			while len(stream.frames)>1 and abs(stream.frames[1][0]-reference) <= abs(stream.frames[0][0]-reference):
+				self._release(stream, stream.frames.popleft())
+				stream.dropped += 1
+				metrics.inc("multiVideo.dropped")
+		item = stream.frames.popleft()
+		self._release(stream, item)
+		return item
+
+	def _popAt(self, stream: _Stream, reference: float) -> tuple:
+		""" 
+			Return the (timestamp, frame) of the file shown at the reference media time: its oldest buffered frame if it is not
+			later than the reference (removed), otherwise the last returned one (repeated). A file frame is never dropped. Lock needed.
+		"""
+		if len(stream.frames)==0:
+			return None
+		if reference is not None and stream.last is not None and stream.frames[0][0] > reference + 1e-6:
+			return stream.last
+		stream.last = stream.frames.popleft()
+		self._release(stream, stream.last)
+		return stream.last
+
+	def _release(self, stream: _Stream, item: tuple) -> None:
+		stream.bytes -= item[1].nbytes
+		self._bytes -= item[1].nbytes
+
+	def _hasRoom(self, stream: _Stream) -> bool:
+		""" 
+			If the stream can decode another frame without exceeding the buffers limits. Lock needed.
+			A stream without buffered frames always has room: the global limit never starves a source.
+		"""
+		return len(stream.frames) < self.bufferPerStream and (len(stream.frames)==0 or self._bytes < self.maxBufferedBytes)
+
+	def _schedule(self, i: int) -> None:
+		""" Put the stream in the decoders queue (if it is not already there and it has room for a frame). Lock needed. """
+		stream = self.streams[i]
+		if not stream.scheduled and not stream.ended and not self._stopped and (self._hasRoom(stream) or stream.live):
+			stream.scheduled = True
+			self._todo.put(i)
+
+	def _decodeLoop(self) -> None:
+		""" The body of a decoding thread: decode one frame of the next stream in the queue, then put the stream back. """
+		while True:
+			i = self._todo.get()
+			if i is None:
+				break
+			stream = self.streams[i]
+			(grabbed, frame) = stream.capture.read()	#the only blocking call, out of the lock
+			#the time of a file frame is its media time (the position after the read is the one of the frame just read)
+			now = time.perf_counter() if stream.live else stream.capture.get(cv2.CAP_PROP_POS_MSEC)/1000.0
+
+			with self._cond:
+				stream.scheduled = False
+				if not grabbed:
+					self._fail(i)
+				else:
+					stream.decoded += 1
+					#a live source never waits: if its buffer is full the oldest frame is dropped
+					#(a file is scheduled only when it has room, so its frames are never dropped)
+					while stream.live and len(stream.frames)>0 and not self._hasRoom(stream):
+						self._release(stream, stream.frames.popleft())
+						stream.dropped += 1
+						metrics.inc("multiVideo.dropped")
+					stream.frames.append((now, frame))
+					stream.bytes += frame.nbytes
+					self._bytes += frame.nbytes
+					self._schedule(i)
+				self._cond.notify_all()
+
+	def _fail(self, i: int) -> None:
+		""" The stream stops working: a file is ended, a live source is reconnected (after a delay). """
+		stream = self.streams[i]
+		canReconnect = self.maxReconnects is None or stream.reconnects < self.maxReconnects
+		if stream.live and self.reconnect and canReconnect and not self._stopped:
+			stream.reconnects += 1
+			stream.scheduled = True		#no decoder can take it while it is reconnecting
+			timer = Timer(self.reconnectDelay, self._reopen, args=(i,))
+			timer.daemon = True
+			self._timers.add(timer)
+			timer.start()
+		else:
+			stream.ended = True
+
+	def _reopen(self, i: int) -> None:
+		stream = self.streams[i]
+		with self._cond:
+			self._timers.discard(current_thread())
+			if self._stopped:
+				return
+		if stream.capture is not None:
+			stream.capture.release()
+		opened = stream.open()		#it can block: out of the lock
+		with self._cond:
+			stream.scheduled = False
+			if opened:
+				self._schedule(i)
+			else:
+				self._fail(i)
+			self._cond.notify_all()
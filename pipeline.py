@@ -0,0 +1,202 @@
+# import the necessary packages
+from threading import Thread, Event, Lock
+from queue import Queue, Full, Empty
+import time
+
+from metrics import metrics
+
+_END = object()		#sentinel that flows through the queues to close the pipeline
+
+class Pipeline:
+	# The class chain a LoadVideo, a Model and (optionally) a StoreVideo: decode, blob creation, DNN forward (with the processing
+	# of its output) and writing run each one on its own thread, connected by bounded queues. The order of the frames is kept.
+
+	def __init__(self, loader: "LoadVideo", model: "Model", writer: "StoreVideo"=None, confidence: float=0.5,
+			  queueSize: int=4, fullPolicy: str="block", draw: "function"=None, onResult: "function"=None):
+		"""
+		Initialization function of the Pipeline class.
+
+		Parameters:
+		loader (LoadVideo):		The source of the frames (its read() must return None at the end of the stream).
+		model (Model):			The model used to process each frame.
+		writer (StoreVideo):	The optional destination of the (eventually annotated) frames (the output is passed as its detections).
+		confidence (float):		The confidence passed to model.processDnnOutput.
+		queueSize (int):		The maximum number of items waiting between two consecutive stages.
+		fullPolicy (str):		What to do when a queue is full: "block" (wait for the next stage) or "dropOldest" (discard the oldest waiting frame).
+		draw (function):		Optional function(frame, output) -> frame, used to annotate the frame before writing it.
+		onResult (function):	Optional function(index, frame, output) called (in order) for each processed frame.
+		"""
+		if fullPolicy not in ("block", "dropOldest"):
+			raise ValueError("Unknown fullPolicy: {} (use 'block' or 'dropOldest')".format(fullPolicy))
+
+		self.loader = loader
+		self.model = model
+		self.writer = writer
+		self.confidence = confidence
+		self.queueSize = queueSize
+		self.fullPolicy = fullPolicy
+		self.draw = draw
+		self.onResult = onResult
+
+		self.stageNames = ["decode", "blob", "forward", "write"]
+		self.queues = [ Queue(maxsize=queueSize) for _ in self.stageNames[1:] ]
+		self.threads = []
+		self.error = None					#the first exception raised by a stage (the pipeline is stopped)
+
+		self._stopEvent = Event()
+		self._lock = Lock()
+		self._busyTime = { name: 0.0 for name in self.stageNames }	#seconds spent working in each stage
+		self._processed = { name: 0 for name in self.stageNames }	#number of items processed by each stage
+		self._dropped = 0
+		self._startTime = None
+		self._endTime = None
+
+	### Public functions
+	def start(self) -> "Pipeline":
+		""" Start all the stages threads (non blocking). """
+		self._startTime = time.perf_counter()
+		self.threads = [
+			Thread(target=self._decodeStage, daemon=True),
+			Thread(target=self._runStage, args=("blob",	self._blob,    self.queues[0], self.queues[1]), daemon=True),
+			Thread(target=self._runStage, args=("forward", self._forward, self.queues[1], self.queues[2]), daemon=True),
+			Thread(target=self._runStage, args=("write",   self._write,   self.queues[2], None), daemon=True)
+		]
+		for t in self.threads:
+			t.start()
+		return self
+
+	def join(self, timeout: float=None) -> None:
+		""" Wait the end of the processing (end of the stream, stop request or error). """
+		for t in self.threads:
+			t.join(timeout)
+		if self._endTime is None and not any(t.is_alive() for t in self.threads):
+			self._endTime = time.perf_counter()
+
+	def run(self) -> int:
+		""" Process the whole stream (blocking) and return the number of frames that reached the last stage. """
+		self.start()
+		self.join()
+		if self.error is not None:
+			raise self.error
+		return self._processed["write"]
+
+	def stop(self) -> None:
+		""" Ask the pipeline to stop reading new frames (the frames already read are completed). """
+		self._stopEvent.set()
+
+	def stats(self) -> dict:
+		""" Return the processing statistics: fps of the whole pipeline, average time (ms) of each stage, dropped frames and queues depth. """
+		end = self._endTime if self._endTime is not None else time.perf_counter()
+		elapsed = 0.0 if self._startTime is None else end-self._startTime
+		with self._lock:
+			return {
+				"frames":  self._processed["write"],
+				"fps":	   self._processed["write"]/elapsed if elapsed>0 else 0.0,
+				"stageMs": { name: 1000*self._busyTime[name]/self._processed[name] if self._processed[name]>0 else 0.0 for name in self.stageNames },
+				"dropped": self._dropped,
+				"queues":  [ q.qsize() for q in self.queues ]
+			}
+
+	### Stages functions
+	def _blob(self, item: tuple) -> tuple:
+		(i, frame) = item
+		start = metrics.start()
+		blob = self.model.blob(frame)
+		metrics.stop("blob", start)
+		return (i, frame, blob)
+
+	def _forward(self, item: tuple) -> tuple:
+		(i, frame, blob) = item
+		start = metrics.start()
+		self.model.setInput(blob)
+		out = self.model.forward()
+		metrics.stop("forward", start)
+
+		start = metrics.start()
+		(h, w) = frame.shape[:2]
+		output = self.model.processDnnOutput(out, h, w, self.confidence)
+		metrics.stop("postprocess", start)
+		return (i, frame, output)
+
+	def _write(self, item: tuple) -> None:
+		(i, frame, output) = item
+		if self.onResult is not None:
+			self.onResult(i, frame, output)
+		if self.writer is not None:
+			if self.draw is not None:
+				frame = self.draw(frame, output)
+			stop = self.writer.addFrame(frame, detections=output)
+			if stop:
+				self.stop()		#the user asked to stop (e.g.: 'q' pressed on the shown frames)
+
+	### Private functions
+	def _decodeStage(self) -> None:
+		""" The first stage: read the frames from the loader until the end of the stream or a stop request. """
+		i = 0
+		try:
+			while not self._stopEvent.is_set():
+				start = time.perf_counter()
+				frame = self.loader.read()
+				if frame is None:
+					break
+				self._account("decode", start)
+				self._put(self.queues[0], (i, frame))
+				i += 1
+		except Exception as e:
+			self._fail(e)
+		self.queues[0].put(_END)
+
+	def _runStage(self, name: str, function: "function", inQueue: Queue, outQueue: Queue) -> None:
+		""" A generic stage: apply the function to each item of inQueue and forward the result to outQueue. """
+		while True:
+			item = inQueue.get()
+			if item is _END:
+				break
+			if self.error is not None:
+				continue	#after an error only drain the queue (so the previous stages never block)
+
+			start = time.perf_counter()
+			try:
+				out = function(item)
+			except Exception as e:
+				self._fail(e)
+				continue
+			self._account(name, start)
+			if outQueue is not None:
+				self._put(outQueue, out)
+
+		if outQueue is not None:
+			outQueue.put(_END)
+		else:
+			self._endTime = time.perf_counter()
+
+	def _put(self, q: Queue, item: tuple) -> None:
+		""" Put the item in the queue according to the fullPolicy. """
+		if metrics.enabled:
+			metrics.gauge("pipeline.{}Queue".format(self.stageNames[self.queues.index(q)+1]), q.qsize())
+		if self.fullPolicy=="block":
+			q.put(item)
+			return
+
+		while True:
+			try:
+				q.put_nowait(item)
+				return
+			except Full:
+				try:
+					q.get_nowait()	#discard the oldest frame to make space for the new one
+					with self._lock:
+						self._dropped += 1
+					metrics.inc("pipeline.dropped")
+				except Empty:
+					pass
+
+	def _account(self, name: str, start: float) -> None:
+		with self._lock:
+			self._busyTime[name] += time.perf_counter()-start
+			self._processed[name] += 1
+
+	def _fail(self, e: Exception) -> None:
+		if self.error is None:
+			self.error = e
+		self.stop()
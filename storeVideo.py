@@ -1,11 +1,27 @@
 # import the necessary packages
 from imutils.video import VideoStream
+from threading import Thread, Lock
+from queue import Queue, Full
+from bisect import bisect_right
+import numpy as np
+import imutils
+import json
+import time
 import cv2
 
+from metrics import metrics
+
+_ROTATE = object()		#queued instead of a frame to start a new file from the background thread (see EventStoreVideo)
+
 class StoreVideo:
 	# The class accept a sequence of frames and store them as a video.
 
-	def __init__(self, output: str="out", show: bool=False, fps: int=50, width: int=None):
+	# the default container (file extension) of each codec
+	containers = { "MPEG": "avi", "XVID": "avi", "MJPG": "avi", "mp4v": "mp4", "FMP4": "mp4" }
+
+	def __init__(self, output: str="out", show: bool=False, fps: int=50, width: int=None, 
+			  background: bool=False, queueSize: int=64, fullPolicy: str="block",
+			  codec: str="MPEG", container: str=None, segmentSeconds: float=None, segmentFrames: int=None):
 		""" 
 		Initialization function of the StoreVideo class.
   
@@ -14,14 +30,30 @@ class StoreVideo:
 		show (bool):		If to show the processd frames or not. 
 		fps (int):			The fps rate of generated video.
 		width (int):		The width of the output frame after rescaling. If None no rescale is performed.
+		background (bool):	If to resize and encode the frames on a background thread (addFrame only queue them).
+		  NB: in background mode a frame must not be modified after it is passed to addFrame.
+		queueSize (int):	The maximum number of frames waiting to be written (background mode).
+		fullPolicy (str):	What addFrame does when the queue is full (background mode): "block" (wait), "drop" (discard the frame) or "fail" (raise queue.Full).
+		codec (str):		The fourcc of the codec (e.g. MPEG, XVID, MJPG, mp4v).
+		container (str):	The file extension (e.g. avi, mp4). If None the default one of the codec (see containers) is used.
+		segmentSeconds (float):	If given the video is split in files (segments) of this duration: output_00000.avi, output_00001.avi, ...
+		segmentFrames (int):	If given the video is split in files (segments) of this number of frames (with segmentSeconds: the shorter).
+		  The segments are listed in the file output_index.json (and in self.segments), see segmentAt.
 		"""
+		if fullPolicy not in ("block", "drop", "fail"):
+			raise ValueError("Unknown fullPolicy: {} (use 'block', 'drop' or 'fail')".format(fullPolicy))
 		#MPEG -> avi
 		#XVID -> avi
 		
 		#FMP4 -> mp4
-		#MJPG -> mp4
-		self.output = ".".join([output, "avi"])
-		self.codec = "MPEG"
+		#mp4v -> mp4
+		#MJPG -> avi
+		if container is None:
+			container = self.containers.get(codec, "avi")
+		self.base = output
+		self.container = container
+		self.output = ".".join([output, container])
+		self.codec = codec
 		self.fourcc = cv2.VideoWriter_fourcc(*self.codec)	#extension standard
 		
 		# fourcc stands for "Four Character Code" it is a representation of the video file extensions. 
@@ -34,8 +66,29 @@ class StoreVideo:
 		self.writer = None
 		self.h = None
 		self.w = None
+		self.isColor = True
+		self.frames = 0				#the number of frames written
+
+		#segmented output
+		self.segmentSeconds = segmentSeconds
+		self.segmentFrames = segmentFrames
+		self.segmented = segmentSeconds is not None or segmentFrames is not None
+		self.segments = []			#for each segment: its path, first frame, end frame (excluded), start time in the video and wall clock
+		self.indexPath = "_".join([output, "index.json"])
 
-	def addFrame(self, frame: "numpy.ndarray", fps: int=None, isColor: bool=True) -> bool:
+		#background writing
+		self.background = background
+		self.fullPolicy = fullPolicy
+		self.pendingFrames = 0		#frames queued and not yet written
+		self.droppedFrames = 0		#frames discarded because the queue was full ("drop" policy)
+		self.error = None			#the exception raised by the background thread (raised again by addFrame and release)
+		self._lock = Lock()
+		if background:
+			self._queue = Queue(maxsize=queueSize)
+			self._thread = Thread(target=self._writeLoop, daemon=True)
+			self._thread.start()
+
+	def addFrame(self, frame: "numpy.ndarray", fps: int=None, isColor: bool=True, *, detections: "list of list or np.ndarray"=None) -> bool:
 		""" 
 		Add the given frame to the video.
   
@@ -43,10 +96,47 @@ class StoreVideo:
 		frame (numpy.ndarray):	The frame of the camera that need to be add to the video.
 		fps (int):				The fps rate of generated video (it will be consideronly at the first call).
 		isColor (bool):			If the passed frame is colored, False means grayscale.
+		detections:				The detections of the frame (ignored here, see EventStoreVideo).
 
 		Returns:
 		bool: True if the user ask to stop ('q' button when frames are shown), False otherwise.
 		"""
+		if self.background:
+			self._enqueue((frame, fps, isColor))
+			if self.show and self.width is not None:
+				frame = imutils.resize(frame, width=self.width)		#only for showing it (the written one is resized in background)
+		else:
+			frame = self._write(frame, fps, isColor)
+
+		# show the frames (always from the caller thread: opencv windows are not thread safe)
+		return self._show(frame)
+
+	def _show(self, frame: "numpy.ndarray") -> bool:
+		""" Show the frame (if requested), return True if the user ask to stop. """
+		if self.show:
+			cv2.imshow("Frame", frame)
+			key = cv2.waitKey(1) & 0xFF
+
+			# if the `q` key was pressed, break from the loop
+			if key == ord("q"):
+				return True
+		return False
+
+	def release(self) -> None:
+		""" Release the file writer (in background mode: after writing all the pending frames). """
+		if self.background:
+			self._queue.put(None)
+			self._thread.join()
+		if self.writer is not None:
+			self.writer.release()
+			if self.segmented:
+				self._saveIndex()
+		if self.error is not None:
+			raise self.error
+
+	### Private functions
+	def _write(self, frame: "numpy.ndarray", fps: int=None, isColor: bool=True) -> "numpy.ndarray":
+		""" Resize and write the frame (creating the writer at the first call), return the written frame. """
 		# grab the frame from the video stream and resize it to have a maximum width of 300 pixels
 		if self.width is not None:
 			frame = imutils.resize(frame, width=self.width)
@@ -58,24 +148,241 @@ class StoreVideo:
 			
 			# store the image dimensions, initialize the video writer, and construct the zeros array
 			(self.h, self.w) = frame.shape[:2]
-			self.writer = cv2.VideoWriter(self.output, self.fourcc, self.fps, (self.w, self.h), isColor)
+			self.isColor = isColor
+			self._openSegment()
+
+		# rotate to a new file when the segment is full (before writing: no frame is lost)
+		elif self.segmented and self.frames - self.segments[-1]["startFrame"] >= self._framesPerSegment():
+			self._openSegment()
 
 		# write the output frame to file
+		start = metrics.start()
 		self.writer.write(frame)
+		metrics.stop("write", start)
+		self.frames += 1
+		if self.segmented:
+			self.segments[-1]["endFrame"] = self.frames
+		return frame
 
-		# show the frames
-		if self.show:
-			cv2.imshow("Frame", frame)
-			key = cv2.waitKey(1) & 0xFF
+	def _framesPerSegment(self) -> int:
+		""" The number of frames of each segment (the shorter between segmentFrames and segmentSeconds). """
+		limits = [ n for n in (self.segmentFrames, None if self.segmentSeconds is None else round(self.segmentSeconds*self.fps)) if n is not None ]
+		return max(1, min(limits))
 
-			# if the `q` key was pressed, break from the loop
-			if key == ord("q"):
-				return True
-		return False
+	def _openSegment(self) -> None:
+		""" Close the current file (if any) and open the next one, updating the index of the segments. """
+		if self.writer is not None:
+			self.writer.release()
 
-	def release(self) -> None:
-		""" Release the file writer. """
-		self.writer.release()
+		path = self.output
+		if self.segmented:
+			path = "{}_{:05d}.{}".format(self.base, len(self.segments), self.container)
+			if len(self.segments)>0:
+				self._saveIndex()
+			self.segments.append({ "path": path, "startFrame": self.frames, "endFrame": self.frames,
+								   "startTime": self.frames/self.fps, "wallClock": time.time() })
+		self.writer = cv2.VideoWriter(path, self.fourcc, self.fps, (self.w, self.h), self.isColor)
+
+	def _saveIndex(self) -> None:
+		framesPerSegment = self._framesPerSegment()
+		with open(self.indexPath, "w") as f:
+			json.dump({ "fps": self.fps, "framesPerSegment": framesPerSegment if framesPerSegment!=float("inf") else None, "segments": self.segments }, f, indent=1)
+
+	### Segments
+	def segmentAt(self, t: float) -> dict:
+		""" 
+		Return the segment (path, frames range, start time) that contains the frame at the given time (seconds from the 
+		start of the video), None if no frame has been written at that time. The lookup is O(1): all the segments (but 
+		the last) have the same number of frames.
+		"""
+		if not self.segmented or len(self.segments)==0:
+			return None
+		frame = int(t*self.fps)
+		i = frame // self._framesPerSegment()
+		if frame<0 or i>=len(self.segments) or frame>=self.segments[i]["endFrame"]:
+			return None
+		return self.segments[i]
+
+	def _enqueue(self, item: tuple) -> None:
+		""" Queue the frame for the background thread, according to the fullPolicy. """
+		if self.error is not None:
+			raise self.error
+		with self._lock:
+			self.pendingFrames += 1
+		try:
+			self._queue.put(item, block=self.fullPolicy=="block")
+			if metrics.enabled:
+				metrics.gauge("storeVideo.queue", self._queue.qsize())	#qsize takes the queue lock: only when recording
+		except Full:
+			with self._lock:
+				self.pendingFrames -= 1
+				if self.fullPolicy=="drop":
+					self.droppedFrames += 1
+					metrics.inc("storeVideo.dropped")
+					return
+			raise Full("StoreVideo: {} frames are already waiting to be written".format(self._queue.maxsize))
+
+	def _writeLoop(self) -> None:
+		""" The background thread: write the queued frames until the None item arrives. """
+		while True:
+			item = self._queue.get()
+			if item is None:
+				break
+			try:
+				if self.error is None:
+					self._write(*item)
+			except Exception as e:
+				self.error = e
+			with self._lock:
+				self.pendingFrames -= 1
+
+
+################################################################################################################
+class EventStoreVideo(StoreVideo):
+	# The class store only the frames around the events (detections of some classes): the last preSeconds of frames are kept 
+	# in a fixed memory ring buffer and, when an event happen, they are written followed by the frames until postSeconds 
+	# after the last event. Each event is stored in its own file: output_00000.avi, output_00001.avi, ... (see StoreVideo segments).
+	# The ring buffer holds preSeconds*fps full frames (a 1080p BGR frame is ~6 MB: 5 seconds at 50 fps would be ~1.5 GB),
+	# so it is bounded by maxBufferBytes: beyond it less seconds are kept before the event.
+
+	def __init__(self, output: str="out", classes: list=None, minConfidence: float=0.5, preSeconds: float=5.0, postSeconds: float=5.0,
+			  maxBufferBytes: int=256*1024*1024, **kwargs):
+		"""
+		Initialization function of the EventStoreVideo class.
+
+		Parameters:
+		output (str):			The output file location (the base name of the event files).
+		classes (list):			The labels (e.g. "person") or class ids (DETECTION_DTYPE detections) that are events. None means any class.
+		minConfidence (float):	The minimum confidence of a detection to be an event.
+		preSeconds (float):		The seconds of video stored before the event.
+		postSeconds (float):	The seconds of video stored after the last event.
+		maxBufferBytes (int):	The maximum memory of the ring buffer of the frames before the event (None means no limit).
+		kwargs:					The other parameters of StoreVideo (fps, width, codec, background, ...).
+		"""
+		super(EventStoreVideo, self).__init__(output, **kwargs)
+		self.classes = None if classes is None else set(classes)
+		self.minConfidence = minConfidence
+		self.preSeconds = preSeconds
+		self.postSeconds = postSeconds
+		self.maxBufferBytes = maxBufferBytes
+		self._setFps(self.fps)
+		self.segmented = True			#one file for each event
+
+		self.recording = False
+		self.events = 0					#the number of recorded events (files)
+		self._framesLeft = 0			#frames still to write after the last event
+		self._ring = None				#(preFrames, h, w, channels) preallocated frames (less if above maxBufferBytes)
+		self._ringStart = 0				#position of the oldest frame in the ring
+		self._ringCount = 0				#number of valid frames in the ring
+
+	def addFrame(self, frame: "numpy.ndarray", fps: int=None, isColor: bool=True, *, detections: "list of list or np.ndarray"=None) -> bool:
+		"""
+		Add the given frame: it is written only around the events (a Pipeline pass the output of its model as detections).
+
+		Parameters:
+		frame (numpy.ndarray):	The frame of the camera.
+		fps (int), isColor (bool):	See StoreVideo.addFrame (until the first file is opened fps also sets the pre and post frames).
+		detections:				The detections of the frame (the output of YOLOv3/MobileNetSSD.processDnnOutput).
+
+		Returns:
+		bool: True if the user ask to stop ('q' button when frames are shown), False otherwise.
+		"""
+		if fps is not None and fps!=self.fps and self.writer is None and not self.recording:
+			self._setFps(fps)
+		if self.isEvent(detections):
+			if not self.recording:
+				self._startEvent(fps, isColor)
+			self._framesLeft = self.postFrames
+
+		if not self.recording:
+			self._push(frame)
+			return self._show(frame)
+
+		stop = super(EventStoreVideo, self).addFrame(frame, fps, isColor)
+		self._framesLeft -= 1
+		if self._framesLeft<=0:
+			self.recording = False
+		return stop
+
+	def isEvent(self, detections: "list of list or np.ndarray") -> bool:
+		""" Return True if at least one detection has one of the classes and enough confidence. """
+		if detections is None or len(detections)==0:
+			return False
+		if isinstance(detections, np.ndarray) and detections.dtype.names is not None:
+			labels = detections["classId"].tolist()
+			confidences = detections["confidence"].tolist()
+		else:
+			labels = [ d[0] for d in detections ]
+			confidences = [ d[1] for d in detections ]
+		return any( c>=self.minConfidence and (self.classes is None or l in self.classes) for (l, c) in zip(labels, confidences) )
+
+	def segmentAt(self, t: float) -> dict:
+		""" Return the event file that contains the written frame at the given time (seconds of the written video), None if not found. """
+		frame = int(t*self.fps)
+		i = bisect_right([ seg["startFrame"] for seg in self.segments ], frame) - 1
+		if i<0 or frame>=self.segments[i]["endFrame"]:
+			return None
+		return self.segments[i]
+
+	### Private functions
+	def _setFps(self, fps: int) -> None:
+		""" Set the fps of the video and the number of frames stored before and after the events. """
+		self.fps = fps
+		self.preFrames = max(0, int(round(self.preSeconds*fps)))
+		self.postFrames = max(1, int(round(self.postSeconds*fps)))
+
+	def _framesPerSegment(self) -> int:
+		# the files are rotated only at the start of the events
+		return float("inf")
+
+	def _startEvent(self, fps: int, isColor: bool) -> None:
+		""" Open a new file and write the frames of the ring buffer (the oldest first). """
+		self.recording = True
+		self.events += 1
+		if self.events>1:
+			self._rotate()
+		#the buffered frames go straight to the file (they were already shown)
+		for i in range(self._ringCount):
+			frame = self._ring[(self._ringStart+i) % len(self._ring)]
+			if self.background:
+				self._enqueue((frame.copy(), fps, isColor))		#copy it: the ring slot will be overwritten
+			else:
+				self._write(frame, fps, isColor)
+		self._ringCount = 0
+
+	def _rotate(self) -> None:
+		""" Start a new file (in background mode after the frames already queued). """
+		if self.background:
+			with self._lock:
+				self.pendingFrames += 1
+			self._queue.put((_ROTATE, None, None))	#never dropped: it is not a frame
+		else:
+			self._openSegment()
+
+	def _write(self, frame: "numpy.ndarray", fps: int=None, isColor: bool=True) -> "numpy.ndarray":
+		if frame is _ROTATE:		#a rotation queued by the caller thread (background mode)
+			self._openSegment()
+			return None
+		return super(EventStoreVideo, self)._write(frame, fps, isColor)
+
+	def _push(self, frame: "numpy.ndarray") -> None:
+		""" Copy the frame in the ring buffer (overwriting the oldest one when it is full). """
+		size = self.preFrames
+		if self.maxBufferBytes is not None:
+			size = min(size, self.maxBufferBytes // frame.nbytes)
+		if size==0:
+			return
+		if self._ring is None or self._ring.shape[1:]!=frame.shape or len(self._ring)!=size:
+			if size<self.preFrames:
+				print("[INFO] Warning: only {} of {} frames are kept before an event (maxBufferBytes: {})".format(size, self.preFrames, self.maxBufferBytes))
+			self._ring = np.empty((size,) + frame.shape, dtype=frame.dtype)
+			(self._ringStart, self._ringCount) = (0, 0)
+		if self._ringCount < len(self._ring):
+			self._ring[(self._ringStart+self._ringCount) % len(self._ring)] = frame
+			self._ringCount += 1
+		else:
+			self._ring[self._ringStart] = frame
+			self._ringStart = (self._ringStart+1) % len(self._ring)
 
 
 #if __name__ == "__main__":
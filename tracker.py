@@ -0,0 +1,242 @@
+# import the necessary packages
+import numpy as np
+
+def toBoxes(detections: "list or np.ndarray") -> tuple:
+	"""
+		Convert the detections of processDnnOutput (a list of [label, confidence, [x, y, w, h]] or a DETECTION_DTYPE array)
+		into three arrays: the labels (n,), the confidences (n,) and the boxes (n, 4) as x, y, w, h.
+	"""
+	if isinstance(detections, np.ndarray) and detections.dtype.names is not None:
+		boxes = np.stack([ detections[k] for k in ("x", "y", "w", "h") ], axis=1).astype(np.float64) if len(detections)>0 else np.zeros((0, 4))
+		return (detections["classId"].tolist(), detections["confidence"].astype(np.float64), boxes)
+	labels = [ d[0] for d in detections ]
+	confidences = np.array([ d[1] for d in detections ], dtype=np.float64)
+	boxes = np.array([ d[2] for d in detections ], dtype=np.float64).reshape(-1, 4)
+	return (labels, confidences, boxes)
+
+def iouMatrix(a: "np.ndarray", b: "np.ndarray") -> "np.ndarray":
+	""" Return the (n, m) intersection over union of each box of a (n, 4) with each box of b (m, 4), all as x, y, w, h. """
+	a = a[:, None, :]
+	b = b[None, :, :]
+	iw = np.minimum(a[..., 0]+a[..., 2], b[..., 0]+b[..., 2]) - np.maximum(a[..., 0], b[..., 0])
+	ih = np.minimum(a[..., 1]+a[..., 3], b[..., 1]+b[..., 3]) - np.maximum(a[..., 1], b[..., 1])
+	inter = np.clip(iw, 0, None) * np.clip(ih, 0, None)
+	union = a[..., 2]*a[..., 3] + b[..., 2]*b[..., 3] - inter
+	return np.where(union>0, inter / np.maximum(union, 1e-12), 0.0)
+
+def greedyMatch(score: "np.ndarray", minScore: float) -> list:
+	""" Return the (row, column) couples with the highest scores (each row and column used at most once), with score >= minScore. """
+	(rows, cols) = np.nonzero(score >= minScore)
+	order = np.argsort(-score[rows, cols], kind="stable")
+	usedRows = set()
+	usedCols = set()
+	matches = []
+	for k in order:
+		(r, c) = (rows[k], cols[k])
+		if r not in usedRows and c not in usedCols:
+			usedRows.add(r)
+			usedCols.add(c)
+			matches.append((r, c))
+	return matches
+
+
+class Tracker:
+	# The class assign a persistent id to the detections of a Model frame by frame. Each track has a constant velocity Kalman filter
+	# on the box (center, width, height and their velocities), all the tracks are predicted and corrected together as arrays.
+	# The detector needs to run only every detectInterval frames (see step/shouldDetect): in the frames between the tracks are
+	# propagated by the motion model. With adaptive=True the interval grows while the predictions match the detections and
+	# shrinks when the scene moves (the predictions miss or tracks appear/disappear).
+
+	def __init__(self, minIoU: float=0.3, maxMissed: int=10, minHits: int=1, matchLabels: bool=True,
+			  detectInterval: int=1, adaptive: bool=False, minInterval: int=1, maxInterval: int=15, stableIoU: float=0.6,
+			  processNoise: float=1e-2, measureNoise: float=1e-1):
+		"""
+		Initialization function of the Tracker class.
+
+		Parameters:
+		minIoU (float):			The minimum IoU between a predicted track and a detection to associate them.
+		maxMissed (int):		The number of detector runs without a match after which a track is deleted.
+		minHits (int):			The number of matches needed before a track is returned.
+		matchLabels (bool):		If to associate a detection only to tracks with its same label.
+		detectInterval (int):	Run the detector every detectInterval frames (1 means every frame).
+		adaptive (bool):		If to adapt detectInterval to the motion of the scene (between minInterval and maxInterval).
+		minInterval (int):		The minimum detection interval of the adaptive mode.
+		maxInterval (int):		The maximum detection interval of the adaptive mode.
+		stableIoU (float):		In adaptive mode: the mean IoU of the matches (prediction vs detection) above which the scene is stable.
+		processNoise (float):	The Kalman process noise (relative to the box size): higher values follow faster changes of motion.
+		measureNoise (float):	The Kalman measurement noise (relative to the box size): higher values trust less the detections.
+		"""
+		self.minIoU = minIoU
+		self.maxMissed = maxMissed
+		self.minHits = minHits
+		self.matchLabels = matchLabels
+		self.detectInterval = max(1, int(detectInterval))
+		self.adaptive = adaptive
+		self.minInterval = max(1, int(minInterval))
+		self.maxInterval = max(self.minInterval, int(maxInterval))
+		self.stableIoU = stableIoU
+		self.processNoise = processNoise
+		self.measureNoise = measureNoise
+
+		#constant velocity model: state = cx, cy, w, h, vcx, vcy, vw, vh (the velocities are per frame)
+		self._F = np.eye(8)
+		self._F[:4, 4:] = np.eye(4)
+		self._H = np.eye(4, 8)
+
+		self._x = np.zeros((0, 8))		#the states of the tracks
+		self._P = np.zeros((0, 8, 8))	#the covariances of the tracks
+		self.ids = []					#the persistent id of each track
+		self.labels = []
+		self.confidences = np.zeros(0)
+		self.hits = np.zeros(0, dtype=np.int64)		#number of detections matched by each track
+		self.missed = np.zeros(0, dtype=np.int64)	#consecutive detector runs without a match
+		self.nextId = 0
+		self.frames = 0					#frames seen (step, update and predict)
+		self.detections = 0				#frames processed by the detector
+		self._sinceDetection = 0
+
+	### Public functions
+	def update(self, detections: "list or np.ndarray") -> list:
+		"""
+			Process the detections of a frame (the output of processDnnOutput): the tracks are predicted to this frame, associated
+			to the detections with IoU and corrected. The unmatched detections start new tracks. Return the tracks (see tracks).
+		"""
+		self._predict()
+		(labels, confidences, boxes) = toBoxes(detections)
+		self.frames += 1
+		self.detections += 1
+		self._sinceDetection = 0
+
+		predicted = self._boxes()
+		score = iouMatrix(predicted, boxes)
+		if self.matchLabels and score.size>0:
+			score[np.array(self.labels, dtype=object)[:, None] != np.array(labels, dtype=object)[None, :]] = 0
+		matches = greedyMatch(score, self.minIoU)
+
+		matchedTracks = np.array([ r for (r, _) in matches ], dtype=np.int64)
+		matchedDets = np.array([ c for (_, c) in matches ], dtype=np.int64)
+		self._correct(matchedTracks, boxes[matchedDets])
+		self.confidences[matchedTracks] = confidences[matchedDets]
+		self.hits[matchedTracks] += 1
+		self.missed += 1
+		self.missed[matchedTracks] = 0
+
+		#the motion of the scene: how well the tracks predicted the detections, and how many tracks appeared or are lost
+		meanIoU = float(score[matchedTracks, matchedDets].mean()) if len(matches)>0 else None
+		changes = (len(boxes) - len(matches)) + int((self.missed==1).sum())
+
+		self._remove(self.missed > self.maxMissed)
+		newDets = np.setdiff1d(np.arange(len(boxes)), matchedDets)
+		self._add([ labels[i] for i in newDets ], confidences[newDets], boxes[newDets])
+
+		if self.adaptive:
+			self._adapt(meanIoU, changes)
+		return self.tracks()
+
+	def predict(self) -> list:
+		""" Propagate the tracks to the next frame with the motion model only (no detector). Return the tracks (see tracks). """
+		self._predict()
+		self.frames += 1
+		self._sinceDetection += 1
+		return self.tracks()
+
+	def shouldDetect(self) -> bool:
+		""" Return True if the detector has to run on the next frame (the first frame, or detectInterval frames after the last run). """
+		return self.detections==0 or self._sinceDetection+1 >= self.detectInterval
+
+	def step(self, frame: "image", model: "Model", confidence: float=0.5) -> list:
+		""" Process the next frame: run model.feed and update if the detector is due (see shouldDetect), otherwise predict. """
+		if self.shouldDetect():
+			return self.update(model.feed(frame, confidence))
+		return self.predict()
+
+	def tracks(self) -> list:
+		"""
+			Return the current tracks (with at least minHits matches) as the detections of processDnnOutput plus the track id:
+			a list of [label, confidence, [x, y, w, h], id].
+		"""
+		boxes = np.rint(self._boxes()).astype(int).tolist()
+		return [ [self.labels[i], float(self.confidences[i]), boxes[i], self.ids[i]]
+				 for i in range(len(self.ids)) if self.hits[i] >= self.minHits ]
+
+	def reset(self) -> None:
+		""" Delete all the tracks (the ids are not reused). """
+		self._remove(np.ones(len(self.ids), dtype=bool))
+		self.detections = 0
+		self._sinceDetection = 0
+
+	def stats(self) -> dict:
+		""" Return the number of frames, the frames processed by the detector (and their ratio), the current interval and tracks. """
+		return { "frames": self.frames, "detections": self.detections,
+				 "detectionRatio": self.detections/self.frames if self.frames>0 else 0.0,
+				 "detectInterval": self.detectInterval, "tracks": len(self.ids), "nextId": self.nextId }
+
+	### Private functions
+	def _boxes(self) -> "np.ndarray":
+		""" Return the boxes of the tracks as x, y, w, h (n, 4). """
+		(c, s) = (self._x[:, :2], np.clip(self._x[:, 2:4], 1, None))
+		return np.concatenate([c - s/2, s], axis=1)
+
+	def _noise(self, scale: float, size: "np.ndarray") -> "np.ndarray":
+		""" Return the (n, k, k) diagonal covariances proportional to the squared size of each box. """
+		return np.einsum("ni,ij->nij", (scale * size)**2, np.eye(size.shape[1]))
+
+	def _predict(self) -> None:
+		if len(self.ids)==0:
+			return
+		wh = np.clip(self._x[:, 2:4], 1, None)
+		q = self._noise(self.processNoise, np.concatenate([wh, wh, wh, wh], axis=1))
+		self._x = self._x @ self._F.T
+		self._P = self._F @ self._P @ self._F.T + q
+
+	def _correct(self, tracks: "np.ndarray", boxes: "np.ndarray") -> None:
+		""" Kalman correction of the given tracks with the given boxes (x, y, w, h). """
+		if len(tracks)==0:
+			return
+		z = np.concatenate([boxes[:, :2] + boxes[:, 2:]/2, boxes[:, 2:]], axis=1)
+		wh = boxes[:, 2:]
+		r = self._noise(self.measureNoise, np.concatenate([wh, wh], axis=1))
+		x = self._x[tracks]
+		P = self._P[tracks]
+		S = self._H @ P @ self._H.T + r
+		K = P @ self._H.T @ np.linalg.inv(S)
+		self._x[tracks] = x + np.einsum("nij,nj->ni", K, z - x @ self._H.T)
+		self._P[tracks] = (np.eye(8) - K @ self._H) @ P
+
+	def _add(self, labels: list, confidences: "np.ndarray", boxes: "np.ndarray") -> None:
+		n = len(labels)
+		if n==0:
+			return
+		x = np.zeros((n, 8))
+		x[:, :2] = boxes[:, :2] + boxes[:, 2:]/2
+		x[:, 2:4] = boxes[:, 2:]
+		wh = np.clip(boxes[:, 2:], 1, None)
+		#the position is known as well as a measurement, the velocity is unknown
+		P = self._noise(1.0, np.concatenate([self.measureNoise*wh, self.measureNoise*wh, wh, wh], axis=1))
+
+		self._x = np.concatenate([self._x, x])
+		self._P = np.concatenate([self._P, P])
+		self.ids.extend(range(self.nextId, self.nextId+n))
+		self.nextId += n
+		self.labels.extend(labels)
+		self.confidences = np.concatenate([self.confidences, confidences])
+		self.hits = np.concatenate([self.hits, np.ones(n, dtype=np.int64)])
+		self.missed = np.concatenate([self.missed, np.zeros(n, dtype=np.int64)])
+
+	def _remove(self, mask: "np.ndarray") -> None:
+		keep = ~mask
+		self._x = self._x[keep]
+		self._P = self._P[keep]
+		self.ids = [ i for (i, k) in zip(self.ids, keep) if k ]
+		self.labels = [ l for (l, k) in zip(self.labels, keep) if k ]
+		self.confidences = self.confidences[keep]
+		self.hits = self.hits[keep]
+		self.missed = self.missed[keep]
+
+	def _adapt(self, meanIoU: float, changes: int) -> None:
+		""" Grow the detection interval by one frame while the scene is stable, halve it when the scene moves. """
+		stable = changes==0 and (meanIoU is None or meanIoU >= self.stableIoU)
+		if stable:
+			self.detectInterval = min(self.maxInterval, self.detectInterval+1)
+		else:
+			self.detectInterval = max(self.minInterval, self.detectInterval//2)